@@ -2,14 +2,23 @@ from datetime import datetime, timedelta, timezone
 from typing import Annotated
 
 import re
+import uuid
+import hashlib
+
 import jwt
 from fastapi import Depends, HTTPException, status
 from jwt.exceptions import InvalidTokenError
 
+from app.core.cache import principal_cache
 from app.core.config import settings
-from app.core.security import pwd_context, oauth2_scheme, TokenData, token_blacklist
+from app.core.hashing import password_hasher
+from app.core.revocation import revocation_store
+from app.core.security_versions import security_versions
+from app.core.security import oauth2_scheme, TokenData
+
+from app.db.database import read_session_factory
 
-from app.models.user import User, user_operations
+from app.models.user import User, User_In_DB
 
 from app.crud.user import user_CRUD_operations
 
@@ -18,28 +27,46 @@ def check_if_active(user : User):
     if user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
 
-def verify_password(plain_password : str, hashed_password : str):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password : str, hashed_password : str):
+    return await password_hasher.verify(plain_password, hashed_password)
+
 
+async def get_password_hash(password : str):
+    return await password_hasher.hash(password)
 
-def get_password_hash(password : str):
-    return pwd_context.hash(password)
+
+async def is_principal_current(user: User_In_DB):
+    # A write only invalidates the cache of the worker that made it, so other workers
+    # check the shared security versions and the revocation left behind by a delete
+    if await security_versions.is_stale(user.id, user.security_version):
+        return False
+    return not await revocation_store.is_revoked(f"user:{user.id}")
 
 
 async def get_user(email: str):
-    if await user_operations.check_if_email_exists(email):
-        user_from_db = await user_CRUD_operations.get_user_by_email(email)
-        return user_from_db
-    else:
+    cached_user = principal_cache.get(email)
+    if cached_user is not None:
+        if await is_principal_current(cached_user):
+            return cached_user
+        principal_cache.invalidate(email)
+
+    user_from_db = await user_CRUD_operations.get_user_by_email(email)
+    if user_from_db is None:
         return None
 
+    user = User_In_DB.model_validate(user_from_db)
+    principal_cache.set(email, user)
+    return user
+
 
 async def authenticate_user(email: str, password: str):
     user = await get_user(email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
+    # A disabled user must not get a token carrying the current security version
+    check_if_active(user)
     return user
 
 
@@ -50,10 +77,39 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
 
+def decode_access_token(token: str):
+    return jwt.decode(token,
+                      settings.SECRET_KEY,
+                      algorithms=[settings.ALGORITHM],
+                      options={"verify_exp": True}
+                      )
+
+
+def get_token_id(payload: dict, token: str):
+    # Tokens issued before jti was introduced are revoked by a digest of their raw value
+    return payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+
+
+async def get_user_from_claims(payload: dict, credentials_exception: HTTPException):
+    user_id = payload["uid"]
+    if await security_versions.is_stale(user_id, payload.get("sv", 0)):
+        raise credentials_exception
+    if await revocation_store.is_revoked(f"user:{user_id}"):
+        raise credentials_exception
+    # Disabling a user bumps the security version and disabled users cannot log in,
+    # so the disabled claim of a token with a current version is still accurate
+    return User(id=user_id,
+                username=payload.get("username"),
+                email=payload["sub"],
+                role=payload.get("role", "user"),
+                disabled=payload["disabled"])
+
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -61,27 +117,32 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        if token_blacklist.is_blacklisted(token):
+        payload = decode_access_token(token)
+
+        if await revocation_store.is_revoked(get_token_id(payload, token)):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token has been revoked",
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-        payload = jwt.decode(token,
-                             settings.SECRET_KEY,
-                             algorithms=[settings.ALGORITHM],
-                             options={"verify_exp": True}
-                             )
         email = payload.get("sub")
         if email is None:
             raise credentials_exception
         token_data = TokenData(email=email)
     except InvalidTokenError:
         raise credentials_exception
-    user = await get_user(email=token_data.email)
-    if user is None:
-        raise credentials_exception
+
+    # Tokens issued before the disabled claim existed are checked against the stored user
+    if settings.AUTH_STATELESS and "uid" in payload and "disabled" in payload:
+        user = await get_user_from_claims(payload, credentials_exception)
+    else:
+        user = await get_user(email=token_data.email)
+        # The email of a deleted user may since belong to a new account
+        if user is None or payload.get("uid", user.id) != user.id:
+            raise credentials_exception
+    # Reads made for this request follow the user's own recent writes
+    read_session_factory.principal.set(user.id)
     return user
 
 
@@ -2,12 +2,15 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 
-from app.api.dependencies import verify_password
+from app.api.dependencies import verify_password, get_user
+from app.api.pagination import AfterId, Limit, Stream, ndjson_response, json_list_response
 from app.api.permission import permission_operations
 
+from app.core.config import settings
+
 from app.services.validate_service import validate_service_obj
 
-from app.models.user import User, User_In_DB, user_operations
+from app.models.user import User, User_In_DB, user_operations, users_adapter
 
 from app.crud.user import user_CRUD_operations
 
@@ -16,7 +19,8 @@ router = APIRouter()
 
 @router.get("/Get info", response_model=User)
 async def get_my_account_info(current_user: Annotated[User, Depends(permission_operations.require_permission("account", "show_info"))]):
-    return current_user
+    # In stateless auth mode current_user only holds the token claims
+    return await get_user(current_user.email)
 
 @router.post("/Change info")
 async def change_my_account_info(current_user: Annotated[User, Depends(permission_operations.require_permission("account", "change_info"))],
@@ -31,7 +35,8 @@ async def change_my_account_info(current_user: Annotated[User, Depends(permissio
                                  new_address: str = None
                                  ):
     validate_service_obj.validate_password(repeat_password)
-    if not verify_password(repeat_password, current_user.hashed_password):
+    user_record = await get_user(current_user.email)
+    if not await verify_password(repeat_password, user_record.hashed_password):
         raise HTTPException(status_code=400, detail="Wrong password")
     if await user_operations.check_if_username_exists(new_username):
         raise HTTPException(status_code=400, detail="Username already exists")
@@ -50,10 +55,15 @@ async def delete_this_account(current_user: Annotated[User, Depends(permission_o
     else:
         raise HTTPException(status_code=400, detail="Something went wrong")
 
-@router.get("/Show all users")
-async def show_all_users(current_user: Annotated[User, Depends(permission_operations.require_permission("users", "show_all"))]):
-    result = await user_CRUD_operations.select_all_users()
+@router.get("/Show all users", response_model=list[User])
+async def show_all_users(current_user: Annotated[User, Depends(permission_operations.require_permission("users", "show_all"))],
+                         after_id: AfterId = None,
+                         limit: Limit = settings.PAGE_SIZE_DEFAULT,
+                         stream: Stream = False):
+    if stream:
+        return ndjson_response(user_CRUD_operations.stream_all_users(after_id))
+    result = await user_CRUD_operations.select_all_users(after_id, limit)
     if result:
-        return result
+        return json_list_response(users_adapter, result, limit)
     else:
         raise HTTPException(status_code=404, detail="Something went wrong")
@@ -2,14 +2,30 @@ from typing import Annotated
 from datetime import date
 
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
 
 from app.api.permission import permission_operations
 
+from app.core.cache import principal_cache
+from app.core.hashing import password_hasher
+from app.core.idempotency import idempotency_store
+from app.core.leader import scheduler_lease
+from app.core.rate_limit import rate_limiter
+
+from app.db.database import async_engine, read_session_factory
+
 from app.models.user import User
+from app.models.scheduler import Job_run
+from app.models.export_job import Export_job, Export_kind, Export_format, Export_status
 
 from app.crud.user import user_CRUD_operations
 from app.crud.card import Card_CRUD
-from app.crud.transaction import transaction_crud
+from app.crud.transaction import transaction_crud, transaction_buffer
+from app.crud.job_run import job_run_crud
+from app.crud.export_job import export_job_crud
+
+from app.services.cleanup_service import CardCleanupService
+from app.services.export_service import export_service
 
 router = APIRouter()
 
@@ -99,3 +115,66 @@ async def delete_transaction_by_id(current_user: Annotated[User, Depends(permiss
     else:
         raise HTTPException(status_code=404, detail="There is no transaction with this id")
 
+
+@router.get("/Stats")
+async def show_stats(current_user: Annotated[User, Depends(permission_operations.require_permission("check", "show_stats"))]):
+    return {"principal_cache": principal_cache.stats(),
+            "password_hasher": password_hasher.stats(),
+            "transaction_group_commit": transaction_buffer.stats(),
+            "db_pool": async_engine.pool.stats(),
+            "db_replicas": read_session_factory.stats(),
+            "scheduler": scheduler_lease.stats(),
+            "rate_limiter": rate_limiter.stats(),
+            "idempotency": idempotency_store.stats(),
+            "exports": export_service.stats()}
+
+
+@router.post("/Cleanup/Run")
+async def run_cleanup(current_user: Annotated[User, Depends(permission_operations.require_permission("maintenance", "run_cleanup"))],
+                      dry_run : Annotated[bool, Query(description="Only count the rows each step would touch")] = True):
+    return await CardCleanupService.perform_full_cleanup(dry_run)
+
+
+@router.get("/Scheduler/Runs", response_model=list[Job_run])
+async def show_job_runs(current_user: Annotated[User, Depends(permission_operations.require_permission("check", "show_stats"))],
+                        job_id: str | None = None,
+                        limit: Annotated[int, Query(ge=1, le=1000)] = 100):
+    return await job_run_crud.get_recent_runs(job_id, limit)
+
+
+@router.post("/Exports", response_model=Export_job, status_code=202)
+async def start_export(current_user: Annotated[User, Depends(permission_operations.require_permission("maintenance", "export"))],
+                       kind : Export_kind,
+                       format : Export_format = Export_format.csv):
+    return await export_service.enqueue(kind, format, current_user.id)
+
+
+@router.get("/Exports", response_model=list[Export_job])
+async def show_exports(current_user: Annotated[User, Depends(permission_operations.require_permission("maintenance", "export"))],
+                       limit: Annotated[int, Query(ge=1, le=1000)] = 100):
+    return await export_job_crud.get_recent_jobs(limit=limit)
+
+
+@router.get("/Exports/{job_id}", response_model=Export_job)
+async def show_export(current_user: Annotated[User, Depends(permission_operations.require_permission("maintenance", "export"))],
+                      job_id : int):
+    job = await export_job_crud.get_job(job_id)
+    if job:
+        return job
+    else:
+        raise HTTPException(status_code=404, detail="There is no export with this id")
+
+
+@router.get("/Exports/{job_id}/download", response_class=FileResponse)
+async def download_export(current_user: Annotated[User, Depends(permission_operations.require_permission("maintenance", "export"))],
+                          job_id : int):
+    job = await export_job_crud.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="There is no export with this id")
+    if job.status != Export_status.succeeded:
+        raise HTTPException(status_code=409, detail=f"This export is {job.status.value}")
+    path = export_service.file_path(job)
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="The file of this export is gone")
+    # FileResponse answers Range requests with 206, so an interrupted download can be resumed
+    return FileResponse(path, media_type=export_service.media_type(job), filename=job.file_name)
@@ -1,14 +1,16 @@
-from datetime import  timedelta
+from datetime import  datetime, timedelta, timezone
 from typing import Annotated
 
 from fastapi import Depends, HTTPException, status, APIRouter, Query
 from fastapi.security import OAuth2PasswordRequestForm
 
 from app.core.config import settings
-from app.core.security import Token, token_blacklist, oauth2_scheme
+from app.core.revocation import revocation_store
+from app.core.security import Token, oauth2_scheme
 
-from app.api.dependencies import get_password_hash, authenticate_user, create_access_token
+from app.api.dependencies import get_password_hash, authenticate_user, create_access_token, decode_access_token, get_token_id
 from app.api.permission import permission_operations
+from app.api.rate_limit import rate_limit, login_identity
 
 from app.services.validate_service import validate_service_obj
 
@@ -21,6 +23,7 @@ router = APIRouter()
 
 @router.post("/token")
 async def login_for_access_token(
+    _: Annotated[None, Depends(rate_limit("login", login_identity))],
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> Token:
     user = await authenticate_user(form_data.username, form_data.password)
@@ -32,7 +35,13 @@ async def login_for_access_token(
         )
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email,
+              "uid": user.id,
+              "username": user.username,
+              "role": user.role,
+              "disabled": user.disabled,
+              "sv": user.security_version},
+        expires_delta=access_token_expires
     )
     return Token(access_token=access_token, token_type="bearer", expires_in = settings.ACCESS_TOKEN_EXPIRE_MINUTES)
 
@@ -55,7 +64,7 @@ async def sign_in(username: Annotated[str, Query(max_length = 25)],
         raise HTTPException(status_code=400, detail="You repeated the password incorrectly")
 
     await validate_service_obj.validate_password(password)
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash(password)
 
     await user_CRUD_operations.add_new_user(User_In_DB(username = username,
                            hashed_password =hashed_password,
@@ -78,11 +87,13 @@ async def logout(
         token: Annotated[str, Depends(oauth2_scheme)]
 ):
     try:
-        token_blacklist.add_token(token, expires_in_minutes=15)
+        payload = decode_access_token(token)
+        expires_at = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+        await revocation_store.revoke(get_token_id(payload, token), expires_at)
 
         return {
             "message": "Successfully logged out",
-            "details": "Token has been invalidated and will be rejected for 30 minutes",
+            "details": f"Token has been invalidated and will be rejected until {expires_at.isoformat()}",
             "user": current_user.username
         }
     except Exception as e:
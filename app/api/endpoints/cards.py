@@ -1,14 +1,22 @@
+import csv
+
 from datetime import date
 from typing import Annotated
 
-from fastapi import Depends, HTTPException, APIRouter, Query
+from fastapi import Depends, HTTPException, APIRouter, Query, UploadFile
+from fastapi.responses import JSONResponse
 
+from app.api.pagination import AfterId, Limit, Stream, ndjson_response, json_list_response
 from app.api.permission import permission_operations
 
+from app.core.config import settings
+
 from app.services.validate_service import validate_service_obj
+from app.services.card_import_service import CardImportService
 
 from app.models.user import User
-from app.models.card import Payment_system, Card_In_DB, Card_check_functions
+from app.models.ledger import MAX_AMOUNT, to_minor_units
+from app.models.card import Payment_system, Card, Card_In_DB, Card_check_functions, Card_import_result, cards_adapter
 
 from app.crud.card import Card_CRUD
 
@@ -35,11 +43,33 @@ async def add_a_new_card(current_user: Annotated[User, Depends(permission_operat
     else:
         raise HTTPException(status_code=400, detail="A card with this number cannot exist")
 
-@router.get("/Cards")
+@router.post("/Cards/Import", response_model=list[Card_import_result])
+async def import_cards(current_user: Annotated[User, Depends(permission_operations.require_permission("cards", "add_my"))],
+                       file: UploadFile):
+    # Columns / keys: number, carrier_name, expires_date, payment_system, cvv
+    filename = (file.filename or "").lower()
+    if filename.endswith(".csv") or file.content_type == "text/csv":
+        file_format = "csv"
+    elif filename.endswith((".ndjson", ".jsonl")) or file.content_type == "application/x-ndjson":
+        file_format = "ndjson"
+    else:
+        raise HTTPException(status_code=400, detail="Upload a .csv or .ndjson file")
+
+    try:
+        records = CardImportService.read_records(await file.read(), file_format)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot read this file: {e}")
+    if not records:
+        raise HTTPException(status_code=400, detail="No cards in this file")
+    if len(records) > settings.CARD_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"A file can contain at most {settings.CARD_IMPORT_MAX_ROWS} cards")
+    return await CardImportService.import_cards(records, file_format, current_user.id)
+
+@router.get("/Cards", response_model=list[Card])
 async def show_all_my_cards(current_user: Annotated[User, Depends(permission_operations.require_permission("cards", "show_my"))]):
     cards = await Card_CRUD.get_all_cards(current_user.id)
     if cards:
-        return cards
+        return json_list_response(cards_adapter, cards)
     else:
         raise HTTPException(status_code=404, detail="You have no cards")
 
@@ -68,12 +98,27 @@ async def unfreeze_this_card(current_user: Annotated[User, Depends(permission_op
     else:
         raise HTTPException(status_code=404, detail="There is no card with this id")
 
-@router.get("/Cards/Show_all")
-async def show_all_existing_cards(current_user: Annotated[User, Depends(permission_operations.require_permission("cards", "show_all"))]):
-    cards = await Card_CRUD.get_all_existing_cards()
+@router.post("/Cards/limit")
+async def set_card_spend_limit(current_user: Annotated[User, Depends(permission_operations.require_permission("cards", "set_limit_my"))],
+                               card_id : int,
+                               spend_limit : Annotated[float | None, Query(ge=0, le=MAX_AMOUNT, allow_inf_nan=False, description="Leave empty to remove the limit")] = None):
+    spend_limit_minor = to_minor_units(spend_limit) if spend_limit is not None else None
+    if await Card_CRUD.change_card_spend_limit(card_id, current_user.id, spend_limit_minor):
+        return {"message" : "The spend limit of this card is changed"}
+    else:
+        raise HTTPException(status_code=404, detail="There is no card with this id")
+
+@router.get("/Cards/Show_all", response_model=list[Card])
+async def show_all_existing_cards(current_user: Annotated[User, Depends(permission_operations.require_permission("cards", "show_all"))],
+                                  after_id: AfterId = None,
+                                  limit: Limit = settings.PAGE_SIZE_DEFAULT,
+                                  stream: Stream = False):
+    if stream:
+        return ndjson_response(Card_CRUD.stream_all_existing_cards(after_id))
+    cards = await Card_CRUD.get_all_existing_cards(after_id, limit)
     if cards:
-        return cards
+        return json_list_response(cards_adapter, cards, limit)
     else:
-        return {"message" : "There is no cards"}
+        return JSONResponse({"message" : "There is no cards"})
 
 
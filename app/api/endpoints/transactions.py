@@ -1,60 +1,186 @@
-from datetime import date, datetime
+from datetime import date
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter, ValidationError
 
 from app.api.dependencies import get_current_active_user
+from app.api.pagination import AfterId, Limit, Stream, ndjson_response, json_list_response, encode_cursor, decode_cursor
 from app.api.permission import permission_operations
+from app.api.rate_limit import rate_limit
 
 from app.models.user import User
-from app.models.transaction import Status, Transaction
+from app.core.config import settings
+from app.core.idempotency import idempotency_store, request_fingerprint
+
+from app.models.transaction import Transaction, Payment, Payment_result, Payment_outcome, Status, transactions_adapter
+from app.models.transaction import Transaction_search, Transaction_sort, Date_bound
+from app.models.rollup import Spend_period, Spend_period_unit, Merchant_spend
+from app.models.ledger import MAX_AMOUNT
 
 from app.crud.card import Card_CRUD
 from app.crud.transaction import transaction_crud
+from app.crud.rollup import rollup_crud
 
 
 router = APIRouter()
 
 
-@router.post("/Transaction")
-async def make_payment(current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "make_payment"))],
-                            card_id : int,
-                            money_amount : float,
-                            company_name: str = "Free payment"):
-    card = await Card_CRUD.get_card_by_id(card_id,current_user.id)
-    if card:
-        if not card.frozen:
-            transaction_data = {"amount_of_money" : money_amount,
-                                "name" : company_name,
-                                "transaction_date" : date.today(),
-                                "transaction_time" : datetime.now().time(),
-                                "status" : Status.approved,
-                                "card_id" : card_id}
-            await transaction_crud.add_new_transaction(Transaction(**transaction_data), card.id)
-            return {"message" : "Payment was successfully done"}
-        else:
-            raise HTTPException(status_code=400, detail="This card is frozen")
+async def authorize_payment(card_id: int, carrier_id: int, money_amount: float, company_name: str, session=None):
+    outcome, transaction_id = await transaction_crud.authorize_payment(card_id, carrier_id, money_amount, company_name,
+                                                                       session)
+    if outcome == Payment_outcome.approved:
+        return 200, {"message" : "Payment was successfully done", "transaction_id" : transaction_id}
+    elif outcome == Payment_outcome.limit_exceeded:
+        raise HTTPException(status_code=402, detail="This payment exceeds the card's spend limit")
+    elif outcome == Payment_outcome.card_frozen:
+        raise HTTPException(status_code=400, detail="This card is frozen")
+    elif outcome == Payment_outcome.card_expired:
+        raise HTTPException(status_code=400, detail="This card has expired")
     else:
         raise HTTPException(status_code=404, detail="There is no card with this id")
 
-@router.get("/Transactions")
+
+@router.post("/Transaction")
+async def make_payment(_: Annotated[None, Depends(rate_limit("payment"))],
+                            current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "make_payment"))],
+                            card_id : int,
+                            money_amount : Annotated[float, Query(gt=0, le=MAX_AMOUNT, allow_inf_nan=False)],
+                            company_name: str = "Free payment",
+                            idempotency_key: Annotated[str | None, Header(max_length=255)] = None):
+    if idempotency_key is None:
+        _, body = await authorize_payment(card_id, current_user.id, money_amount, company_name)
+        return body
+
+    # A retry with the same key gets the first response back and never reaches the transactions table.
+    # The payment commits together with its stored response, so it is never grouped
+    fingerprint = request_fingerprint(card_id=card_id, money_amount=money_amount, company_name=company_name)
+    status_code, body, replayed = await idempotency_store.run(
+        f"{current_user.id}:{idempotency_key}", fingerprint,
+        lambda session: authorize_payment(card_id, current_user.id, money_amount, company_name, session))
+    return JSONResponse(body, status_code=status_code, headers={"Idempotent-Replayed": str(replayed).lower()})
+
+payments_adapter = TypeAdapter(list[Payment])
+
+PAYMENTS_BODY_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": Payment.model_json_schema()}},
+            "application/x-ndjson": {"schema": {"type": "string"}},
+        },
+    }
+}
+
+
+async def read_payments(request: Request):
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            return [Payment.model_validate_json(line) for line in body.splitlines() if line.strip()]
+        return payments_adapter.validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+
+@router.post("/Transactions/Batch", response_model=list[Payment_result], openapi_extra=PAYMENTS_BODY_SCHEMA)
+async def make_payments_batch(_: Annotated[None, Depends(rate_limit("payment"))],
+                              current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "make_payment"))],
+                              request: Request):
+    payments = await read_payments(request)
+    if not payments:
+        raise HTTPException(status_code=400, detail="No payments in this batch")
+    if len(payments) > settings.PAYMENT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"A batch can contain at most {settings.PAYMENT_BATCH_MAX_SIZE} payments")
+    return await transaction_crud.add_payments_batch(payments, current_user.id)
+
+@router.get("/Transactions", response_model=list[Transaction])
 async def show_transactions_for_a_specific_card(current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "show_for_my_card"))],
-                                                card_id : int):
+                                                card_id : int,
+                                                date_from : date | None = None,
+                                                date_to : date | None = None):
     card = await Card_CRUD.get_card_by_id(card_id, current_user.id)
     if card:
-        transactions = await transaction_crud.get_all_transactions_by_card_id(card.id)
+        transactions = await transaction_crud.get_all_transactions_by_card_id(card.id, date_from, date_to)
         if transactions:
-            return transactions
+            return json_list_response(transactions_adapter, transactions)
         else:
             raise HTTPException(status_code=404, detail="No transactions for this card")
     else:
         raise HTTPException(status_code=404, detail="There is no card with this id")
 
 
-@router.get("/Transactions/Show_all")
-async def show_all_transactions(current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "show_all"))]):
-    transactions = await transaction_crud.get_all_transactions()
+@router.get("/Transactions/Show_all", response_model=list[Transaction])
+async def show_all_transactions(current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "show_all"))],
+                                after_id: AfterId = None,
+                                limit: Limit = settings.PAGE_SIZE_DEFAULT,
+                                stream: Stream = False):
+    if stream:
+        return ndjson_response(transaction_crud.stream_all_transactions(after_id))
+    transactions = await transaction_crud.get_all_transactions(after_id, limit)
     if transactions:
-        return transactions
+        return json_list_response(transactions_adapter, transactions, limit)
+    else:
+        return JSONResponse({"message" : "There is no transactions"})
+
+
+@router.get("/Transactions/Search", response_model=list[Transaction])
+async def search_transactions(current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "show_for_my_card"))],
+                              date_from : Annotated[Date_bound | None, Query(description="Date or date and time, inclusive")] = None,
+                              date_to : Annotated[Date_bound | None, Query(description="Date or date and time, inclusive; a date covers the whole day")] = None,
+                              amount_min : float | None = None,
+                              amount_max : float | None = None,
+                              status : Status | None = None,
+                              merchant : Annotated[str | None, Query(max_length=255, description="Merchant name prefix")] = None,
+                              card_id : int | None = None,
+                              user_id : Annotated[int | None, Query(description="Only for roles that can see all transactions")] = None,
+                              sort : Transaction_sort = Transaction_sort.newest,
+                              cursor : Annotated[str | None, Query(description="X-Next-Cursor of the previous page")] = None,
+                              limit : Annotated[int, Query(ge=1, le=settings.PAGE_SIZE_MAX)] = settings.TRANSACTION_SEARCH_PAGE_SIZE):
+    # Without show_all a search is confined to the caller's own cards
+    if not await permission_operations.check_permission(current_user, "transactions", "show_all"):
+        if user_id is not None and user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Not enough permissions")
+        user_id = current_user.id
+
+    search = Transaction_search(date_from=date_from, date_to=date_to, amount_min=amount_min, amount_max=amount_max,
+                                status=status, merchant=merchant, card_id=card_id, user_id=user_id, sort=sort)
+    after = decode_cursor(cursor) if cursor is not None else None
+    try:
+        transactions = await transaction_crud.search_transactions(search, after, limit)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if transactions is None:
+        raise HTTPException(status_code=503, detail="The search took too long, narrow the filters")
+
+    response = json_list_response(transactions_adapter, transactions)
+    if len(transactions) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(transaction_crud.search_cursor(transactions[-1], sort))
+    return response
+
+
+@router.get("/Analytics/Card_spend", response_model=list[Spend_period])
+async def show_card_spend(current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "show_for_my_card"))],
+                          card_id : int,
+                          period : Spend_period_unit = Spend_period_unit.day,
+                          date_from : date | None = None,
+                          date_to : date | None = None):
+    card = await Card_CRUD.get_card_by_id(card_id, current_user.id)
+    if card:
+        return await rollup_crud.get_card_spend(card.id, period.value, date_from, date_to)
     else:
-        return {"message" : "There is no transactions"}
\ No newline at end of file
+        raise HTTPException(status_code=404, detail="There is no card with this id")
+
+
+@router.get("/Analytics/Top_merchants", response_model=list[Merchant_spend])
+async def show_top_merchants(current_user: Annotated[User, Depends(permission_operations.require_permission("transactions", "show_for_my_card"))],
+                             user_id : int | None = None,
+                             limit : Annotated[int, Query(ge=1, le=100)] = 10,
+                             date_from : date | None = None,
+                             date_to : date | None = None):
+    if user_id is None:
+        user_id = current_user.id
+    elif user_id != current_user.id and not await permission_operations.check_permission(current_user, "transactions", "show_all"):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return await rollup_crud.get_top_merchants(user_id, limit, date_from, date_to)
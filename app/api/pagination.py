@@ -0,0 +1,56 @@
+import base64
+import json
+
+from typing import Annotated
+
+from fastapi import HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+
+from app.core.config import settings
+
+
+AfterId = Annotated[int | None, Query(description="Return rows with id greater than this cursor")]
+Limit = Annotated[int, Query(ge=1, le=settings.PAGE_SIZE_MAX)]
+Stream = Annotated[bool, Query(description="Stream every row as NDJSON instead of a single JSON array")]
+
+
+def set_next_cursor(response: Response, items: list, limit: int | None):
+    if limit is not None and len(items) == limit:
+        response.headers["X-Next-After-Id"] = str(items[-1].id)
+
+
+async def ndjson_lines(items):
+    chunk = []
+    async for item in items:
+        chunk.append(item.model_dump_json())
+        if len(chunk) >= settings.STREAM_CHUNK_SIZE:
+            yield "\n".join(chunk) + "\n"
+            chunk.clear()
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+def ndjson_response(items):
+    return StreamingResponse(ndjson_lines(items), media_type="application/x-ndjson")
+
+
+def json_list_response(adapter: TypeAdapter, items: list, limit: int | None = None):
+    # Encoded straight to bytes by pydantic-core instead of re-validating through the response model
+    response = Response(adapter.dump_json(items), media_type="application/json")
+    set_next_cursor(response, items, limit)
+    return response
+
+
+def encode_cursor(values: list):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
@@ -12,15 +12,16 @@ from app.models.user import User, User_In_DB, UserORM
 class Permission:
     PERMISSION = {
         "admin" :{"users" : ["show_all", "delete_any", "disable_user", "manage_role"],
-                  "cards" : ["add_my", "show_my", "delete_my", "unfreeze_my", "show_all", "delete_any", "unfreeze_any"],
+                  "cards" : ["add_my", "show_my", "delete_my", "unfreeze_my", "set_limit_my", "show_all", "delete_any", "unfreeze_any"],
                   "transactions" : ["make_payment", "show_for_my_card", "show_all", "delete_any"],
                   "account" : ["show_info", "change_info", "delete_my", "logout"],
-                  "check":["health_check"]},
+                  "check":["health_check", "show_stats"],
+                  "maintenance" : ["run_cleanup", "export"]},
         "manager" :{"users" : ["show_all"],
-                  "cards" : ["add_my", "show_my", "delete_my", "unfreeze_my", "show_all"],
+                  "cards" : ["add_my", "show_my", "delete_my", "unfreeze_my", "set_limit_my", "show_all"],
                   "transactions" : ["make_payment", "show_for_my_card", "show_all"],
                   "account" : ["show_info", "change_info", "delete_my", "logout"]},
-        "user" : {"cards" : ["add_my", "show_my", "delete_my", "unfreeze_my"],
+        "user" : {"cards" : ["add_my", "show_my", "delete_my", "unfreeze_my", "set_limit_my"],
                   "transactions" : ["make_payment", "show_for_my_card"],
                   "account" : ["show_info", "change_info", "delete_my", "logout"]}
     }
@@ -63,7 +64,7 @@ class Permission:
 
             #change as soon as possible
             admin = UserORM(username="admin",
-                               hashed_password=get_password_hash("adminqwerty"),
+                               hashed_password=await get_password_hash("adminqwerty"),
                                email="admin",
                                name="System",
                                surname="Administrator",
@@ -0,0 +1,55 @@
+import math
+
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+from app.api.dependencies import get_current_active_user
+
+from app.core.config import settings
+from app.core.rate_limit import rate_limiter
+
+from app.models.user import User
+
+
+def client_ip(request: Request):
+    # Each trusted proxy appends the address it was connected from, so the client is the entry the
+    # outermost one added; anything further left was sent by the client and can be made up
+    proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+    if proxies > 0:
+        forwarded_for = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",")]
+        if len(forwarded_for) >= proxies and forwarded_for[-proxies]:
+            return forwarded_for[-proxies]
+    return request.client.host if request.client else ""
+
+
+def login_identity(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
+    # Keyed by the account being tried, so one victim cannot be brute-forced from many addresses
+    return form_data.username.lower()
+
+
+def user_identity(current_user: Annotated[User, Depends(get_current_active_user)]):
+    return str(current_user.id)
+
+
+async def enforce(route: str, scope: str, identity: str):
+    retry_after = await rate_limiter.check(route, scope, identity)
+    if retry_after > 0:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Too many requests, try again later",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+def rate_limit(route: str, identity_dependency=user_identity):
+    # The per-IP bucket is checked before the identity dependency runs, so a flood from one
+    # address is shed before any token decoding or user lookup. Endpoints declare this dependency
+    # ahead of their other ones, which FastAPI resolves in declaration order
+    async def ip_dependency(request: Request):
+        await enforce(route, "ip", client_ip(request))
+
+    async def rate_limit_dependency(_: Annotated[None, Depends(ip_dependency)],
+                                    identity: Annotated[str, Depends(identity_dependency)]):
+        await enforce(route, "user", identity)
+
+    return rate_limit_dependency
@@ -0,0 +1,67 @@
+import time
+
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.core.metrics import metrics_registry
+
+
+class TTLCache:
+    # LRU bounded map whose entries also expire ttl_seconds after they were set
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value):
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *keys: str):
+        for key in keys:
+            if key is not None:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0}
+
+
+principal_cache = TTLCache(max_size=settings.PRINCIPAL_CACHE_SIZE,
+                           ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS)
+
+metrics_registry.callback("principal_cache_hits_total", "Principal lookups served from the cache",
+                          lambda: principal_cache.hits, "counter")
+metrics_registry.callback("principal_cache_misses_total", "Principal lookups that went to the database",
+                          lambda: principal_cache.misses, "counter")
+metrics_registry.callback("principal_cache_size", "Principals currently cached", lambda: len(principal_cache._entries))
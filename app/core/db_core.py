@@ -1,14 +1,63 @@
-from app.db.database import async_engine,  Base
+from sqlalchemy import select, text
 
+from app.db.database import async_engine
+from app.db.migrations import MIGRATIONS
 
-async def create_tables():
-    async with async_engine.begin() as conn:
-        # await conn.execute(text("DROP TABLE IF EXISTS transactions CASCADE"))
-        # await conn.execute(text("DROP TABLE IF EXISTS cards CASCADE"))
-        # await conn.execute(text("DROP TABLE IF EXISTS users CASCADE"))
-        await conn.run_sync(Base.metadata.create_all)
-    print("Tables are created!")
+from app.models.schema_migration import SchemaMigrationORM
 
 
+# Serializes migration runs between workers that start at the same time
+MIGRATION_LOCK_ID = 7_301_001
 
 
+async def get_applied_versions(conn):
+    await conn.run_sync(SchemaMigrationORM.__table__.create, checkfirst=True)
+    result = await conn.execute(select(SchemaMigrationORM.version))
+    return set(result.scalars().all())
+
+
+async def record_migration(conn, migration):
+    await conn.execute(SchemaMigrationORM.__table__.insert().values(version=migration.version,
+                                                                    name=migration.name))
+
+
+async def pending_migrations():
+    # One catalog lookup and one read of a tiny table, cheap enough for every startup
+    async with async_engine.connect() as conn:
+        if await conn.scalar(text("SELECT to_regclass(:name)"), {"name": SchemaMigrationORM.__tablename__}) is None:
+            return list(MIGRATIONS)
+        applied = set((await conn.execute(select(SchemaMigrationORM.version))).scalars().all())
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+async def ensure_schema():
+    if await pending_migrations():
+        await run_migrations()
+    else:
+        print("Database schema is up to date!")
+
+
+async def run_migrations():
+    async with async_engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            async with async_engine.begin() as conn:
+                applied = await get_applied_versions(conn)
+
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+                print(f"Applying migration {migration.version}: {migration.name}")
+                if migration.transactional:
+                    async with async_engine.begin() as conn:
+                        await migration.upgrade(conn)
+                        await record_migration(conn, migration)
+                else:
+                    async with async_engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        await migration.upgrade(conn)
+                        await record_migration(conn, migration)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    print("Database schema is up to date!")
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.metrics import metrics_registry, password_hash_duration_seconds
+from app.core.security import pwd_context
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.hash_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+        self.wait_seconds_total = 0.0
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(pwd_context.verify, plain_password, hashed_password)
+
+    async def _submit(self, func, *args):
+        # bcrypt releases the GIL, so a thread pool keeps the event loop free;
+        # past workers + queue_size callers we shed load instead of queueing
+        if self.in_flight >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Password hashing is overloaded, try again later",
+                                headers={"Retry-After": "1"})
+
+        self.in_flight += 1
+        submitted = time.perf_counter()
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._timed, func, *args)
+        finally:
+            self.in_flight -= 1
+
+        self.completed += 1
+        self.wait_seconds_total += started - submitted
+        self.hash_seconds_total += finished - started
+        password_hash_duration_seconds.observe(finished - started, func.__name__)
+        self.hash_seconds_max = max(self.hash_seconds_max, finished - started)
+        return result
+
+    @staticmethod
+    def _timed(func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        return result, started, time.perf_counter()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {"workers": self.workers,
+                "queue_size": self.queue_size,
+                "in_flight": self.in_flight,
+                "queue_depth": max(self.in_flight - self.workers, 0),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_hash_seconds": self.hash_seconds_total / self.completed if self.completed else 0.0,
+                "max_hash_seconds": self.hash_seconds_max,
+                "avg_wait_seconds": self.wait_seconds_total / self.completed if self.completed else 0.0}
+
+
+password_hasher = PasswordHasher(workers=settings.PASSWORD_HASH_WORKERS,
+                                 queue_size=settings.PASSWORD_HASH_QUEUE_SIZE)
+
+metrics_registry.callback("password_hash_in_flight", "Hash and verify calls running or queued in the pool",
+                          lambda: password_hasher.in_flight)
+metrics_registry.callback("password_hash_rejected_total", "Hash and verify calls rejected because the pool was full",
+                          lambda: password_hasher.rejected, "counter")
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+
+from datetime import timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import delete, exc, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.metrics import metrics_registry
+
+from app.db.database import async_session_factory
+from app.db.retry import run_with_retry
+
+from app.models.idempotency import IdempotencyKeyORM
+
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+idempotent_replays_total = metrics_registry.counter(
+    "idempotent_replays_total", "Responses replayed for a repeated Idempotency-Key", ("source",))
+
+
+def request_fingerprint(**params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, cache_size: int, ttl_seconds: float, wait_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        # key -> (fingerprint, status_code, body)
+        self._responses = TTLCache(max_size=cache_size, ttl_seconds=ttl_seconds)
+        self._in_flight = {}
+
+    async def run(self, key: str, fingerprint: str, handler):
+        # handler(session) -> (status_code, body), run inside the transaction that stores its response;
+        # returns (status_code, body, replayed)
+        cached = self._responses.get(key)
+        if cached is not None:
+            idempotent_replays_total.inc("memory")
+            return self._check_fingerprint(cached, fingerprint) + (True,)
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            # A duplicate in this worker shares the original's outcome instead of racing it
+            response = await asyncio.shield(in_flight)
+            idempotent_replays_total.inc("in_flight")
+            return self._check_fingerprint(response, fingerprint) + (True,)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response, replayed = await run_with_retry(lambda: self._run_once(key, fingerprint, handler))
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting on it, which is fine
+            future.exception()
+            raise
+        else:
+            future.set_result(response)
+        finally:
+            self._in_flight.pop(key, None)
+
+        self._responses.set(key, response)
+        return self._check_fingerprint(response, fingerprint) + (replayed,)
+
+    async def _run_once(self, key: str, fingerprint: str, handler):
+        # The key row, the handler's writes and the stored response commit or roll back together, so a
+        # committed key always has its response and a request that did not commit left nothing behind.
+        # A duplicate blocks on the uncommitted key row for up to wait_seconds, then sees the response.
+        async with async_session_factory() as session:
+            await session.execute(text(f"SET LOCAL lock_timeout = {int(self.wait_seconds * 1000)}"))
+            try:
+                claimed = (await session.execute(self._claim_stmt(key, fingerprint))).scalar_one_or_none()
+            except exc.DBAPIError as e:
+                if getattr(e.orig, "sqlstate", None) != LOCK_NOT_AVAILABLE:
+                    raise
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                                    headers={"Retry-After": "1"})
+            await session.execute(text("SET LOCAL lock_timeout TO DEFAULT"))
+
+            if claimed is None:
+                stored = (await session.execute(
+                    select(IdempotencyKeyORM).where(IdempotencyKeyORM.key == key))).scalar_one()
+                if stored.status_code is None:
+                    # Claimed by an older release that committed the key before the payment; its
+                    # outcome is unknown, so it is never run again
+                    raise HTTPException(status_code=409, detail="The outcome of the request with this "
+                                                                "Idempotency-Key is unknown")
+                idempotent_replays_total.inc("database")
+                return (stored.fingerprint, stored.status_code, stored.body), True
+
+            try:
+                status_code, body = await handler(session)
+            except HTTPException as e:
+                status_code, body = e.status_code, {"detail": e.detail}
+            await session.execute(update(IdempotencyKeyORM)
+                                  .where(IdempotencyKeyORM.key == key)
+                                  .values(status_code=status_code, body=body))
+            await session.commit()
+            return (fingerprint, status_code, body), False
+
+    def _claim_stmt(self, key: str, fingerprint: str):
+        # Returns the key when this request owns it; only an expired key is taken over
+        stmt = insert(IdempotencyKeyORM).values(key=key,
+                                                fingerprint=fingerprint,
+                                                created_at=func.now(),
+                                                expires_at=func.now() + timedelta(seconds=self.ttl_seconds))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKeyORM.key],
+            set_={"fingerprint": stmt.excluded.fingerprint,
+                  "status_code": None,
+                  "body": None,
+                  "created_at": stmt.excluded.created_at,
+                  "expires_at": stmt.excluded.expires_at},
+            where=IdempotencyKeyORM.expires_at < func.now(),
+        )
+        return stmt.returning(IdempotencyKeyORM.key)
+
+    @staticmethod
+    def _check_fingerprint(response, fingerprint: str):
+        stored_fingerprint, status_code, body = response
+        if stored_fingerprint != fingerprint:
+            raise HTTPException(status_code=422,
+                                detail="This Idempotency-Key was already used with different parameters")
+        return status_code, body
+
+    async def purge_expired(self):
+        async with async_session_factory() as session:
+            result = await session.execute(delete(IdempotencyKeyORM).where(IdempotencyKeyORM.expires_at < func.now()))
+            await session.commit()
+            return result.rowcount
+
+    def stats(self):
+        return {"cache": self._responses.stats(),
+                "in_flight": len(self._in_flight),
+                "ttl_seconds": self.ttl_seconds,
+                "wait_seconds": self.wait_seconds}
+
+
+idempotency_store = IdempotencyStore(cache_size=settings.IDEMPOTENCY_CACHE_SIZE,
+                                     ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+                                     wait_seconds=settings.IDEMPOTENCY_WAIT_SECONDS)
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import socket
+
+from datetime import timedelta
+
+from sqlalchemy import delete, exc, func, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import settings
+from app.core.metrics import metrics_registry
+
+from app.db.database import async_session_factory
+
+from app.models.scheduler import SchedulerLeaseORM
+
+
+class LeaderLease:
+    # Expiry is compared against the database clock, so nodes never have to agree on time
+    def __init__(self, name: str, node: str, lease_seconds: float, renew_seconds: float):
+        self.name = name
+        self.node = node
+        self.lease_seconds = lease_seconds
+        self.renew_seconds = renew_seconds
+        self.is_leader = False
+        self.elections_won = 0
+        # Called without arguments every time this node takes over the lease
+        self.on_elected = []
+        self._task = None
+
+    async def try_acquire(self):
+        # Take the lease if it is free or expired, extend it if it is already ours
+        stmt = insert(SchedulerLeaseORM).values(name=self.name,
+                                                holder=self.node,
+                                                expires_at=func.now() + timedelta(seconds=self.lease_seconds))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SchedulerLeaseORM.name],
+            set_={"holder": stmt.excluded.holder, "expires_at": stmt.excluded.expires_at},
+            where=or_(SchedulerLeaseORM.holder == stmt.excluded.holder, SchedulerLeaseORM.expires_at < func.now()),
+        ).returning(SchedulerLeaseORM.holder)
+        try:
+            async with async_session_factory() as session:
+                acquired = (await session.execute(stmt)).scalar_one_or_none() is not None
+                await session.commit()
+        except (exc.SQLAlchemyError, OSError, asyncio.TimeoutError):
+            # Without a database round trip the lease cannot be proven, so step down
+            acquired = False
+        was_leader = self.is_leader
+        self.is_leader = acquired
+        if acquired and not was_leader:
+            self.elections_won += 1
+            print(f"Node {self.node} became the scheduler leader")
+            for callback in self.on_elected:
+                callback()
+        elif was_leader and not acquired:
+            print(f"Node {self.node} lost the scheduler leadership")
+        return acquired
+
+    async def release(self):
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        async with async_session_factory() as session:
+            await session.execute(delete(SchedulerLeaseORM).where(SchedulerLeaseORM.name == self.name,
+                                                                  SchedulerLeaseORM.holder == self.node))
+            await session.commit()
+
+    async def _renew_forever(self):
+        while True:
+            await asyncio.sleep(self.renew_seconds)
+            await self.try_acquire()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._renew_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.release()
+
+    def stats(self):
+        return {"node": self.node,
+                "is_leader": self.is_leader,
+                "lease_seconds": self.lease_seconds,
+                "renew_seconds": self.renew_seconds,
+                "elections_won": self.elections_won}
+
+
+scheduler_lease = LeaderLease(name="scheduler",
+                              node=settings.SCHEDULER_NODE_ID or f"{socket.gethostname()}:{os.getpid()}",
+                              lease_seconds=settings.SCHEDULER_LEASE_SECONDS,
+                              renew_seconds=settings.SCHEDULER_LEASE_SECONDS / 3)
+
+metrics_registry.callback("scheduler_is_leader", "1 if this worker currently holds the scheduler lease",
+                          lambda: int(scheduler_lease.is_leader))
@@ -0,0 +1,214 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import time
+
+from collections import defaultdict
+
+from sqlalchemy import event
+
+
+# Name of the CRUD/service method whose queries are currently running, used to label query timings
+query_label = contextvars.ContextVar("query_label", default="other")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labelnames, labels, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] += amount
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class CallbackMetric:
+    # Reads its value(s) at scrape time, for state that already lives in other objects' stats()
+    def __init__(self, name: str, documentation: str, callback, metric_type: str = "gauge", labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.type = metric_type
+        self.labelnames = labelnames
+
+    def samples(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            for labels, sample in value.items():
+                if sample is not None:
+                    yield f"{self.name}{format_labels(self.labelnames, labels)} {float(sample)}"
+        elif value is not None:
+            yield f"{self.name} {float(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, callback, metric_type: str = "gauge", labelnames: tuple = ()):
+        return self.register(CallbackMetric(name, documentation, callback, metric_type, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+http_requests_total = metrics_registry.counter(
+    "http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+http_request_duration_seconds = metrics_registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+db_query_duration_seconds = metrics_registry.histogram(
+    "db_query_duration_seconds", "SQL statement latency by calling CRUD method", ("operation",))
+cleanup_step_duration_seconds = metrics_registry.histogram(
+    "cleanup_step_duration_seconds", "Duration of each cleanup step", ("step",))
+cleanup_rows_affected_total = metrics_registry.counter(
+    "cleanup_rows_affected_total", "Rows updated or deleted by each cleanup step", ("step",))
+password_hash_duration_seconds = metrics_registry.histogram(
+    "password_hash_duration_seconds", "bcrypt time spent in the hashing pool", ("operation",))
+
+
+def instrument_queries(cls):
+    # Labels every query issued from the class's async static methods with "ClassName.method"
+    for attr_name, attr in list(vars(cls).items()):
+        if not isinstance(attr, staticmethod):
+            continue
+        func = attr.__func__
+        label = f"{cls.__name__}.{attr_name}"
+        if inspect.iscoroutinefunction(func):
+            setattr(cls, attr_name, staticmethod(_labelled_coroutine(func, label)))
+        elif inspect.isasyncgenfunction(func):
+            setattr(cls, attr_name, staticmethod(_labelled_async_generator(func, label)))
+    return cls
+
+
+def _labelled_coroutine(func, label: str):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = query_label.set(label)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            query_label.reset(token)
+    return wrapper
+
+
+def _labelled_async_generator(func, label: str):
+    # An async generator is resumed from its consumer's context, so the label is set
+    # again before every step instead of being reset afterwards
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        query_label.set(label)
+        async for item in func(*args, **kwargs):
+            yield item
+            query_label.set(label)
+    return wrapper
+
+
+def install_query_timing(engine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_query_duration_seconds.observe(time.perf_counter() - started, query_label.get())
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            http_request_duration_seconds.observe(time.perf_counter() - started, scope["method"], route_path)
+            http_requests_total.inc(scope["method"], route_path, status_code)
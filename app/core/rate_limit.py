@@ -0,0 +1,139 @@
+import time
+
+from collections import OrderedDict
+from datetime import timedelta
+
+from sqlalchemy import case, delete, exc, func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import settings
+from app.core.metrics import metrics_registry
+
+from app.db.database import async_session_factory
+
+from app.models.rate_limit import RateLimitBucketORM
+
+
+PERIOD_SECONDS = {"second": 1, "minute": 60, "hour": 3600}
+
+rate_limited_requests_total = metrics_registry.counter(
+    "rate_limited_requests_total", "Requests rejected by the rate limiter", ("route", "scope"))
+
+
+def parse_rule(rule: str):
+    # "10/minute" -> (burst=10, refill rate in tokens per second)
+    if not rule:
+        return None
+    count, period = rule.split("/")
+    burst = int(count)
+    return burst, burst / PERIOD_SECONDS[period.strip()]
+
+
+class MemoryRateLimitBackend:
+    # Buckets live in this process only, so every worker enforces the full limit on its own
+    shared = False
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, burst: int, rate: float):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    async def purge_stale(self, older_than: timedelta):
+        return 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class DatabaseRateLimitBackend:
+    shared = True
+
+    async def take(self, key: str, burst: int, rate: float):
+        # Refill and take in one upsert, timed by the database clock so workers never disagree
+        bucket = RateLimitBucketORM
+        refilled = func.least(burst, bucket.tokens + func.extract("epoch", func.now() - bucket.updated_at) * rate)
+        stmt = insert(bucket).values(key=key, tokens=burst - 1, updated_at=func.now(), allowed=True)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[bucket.key],
+            set_={"tokens": case((refilled >= 1, refilled - 1), else_=refilled),
+                  "updated_at": func.now(),
+                  "allowed": refilled >= 1},
+        ).returning(bucket.allowed, bucket.tokens)
+        async with async_session_factory() as session:
+            row = (await session.execute(stmt)).one()
+            await session.commit()
+        return row.allowed, row.tokens
+
+    async def purge_stale(self, older_than: timedelta):
+        async with async_session_factory() as session:
+            stmt = delete(RateLimitBucketORM).where(RateLimitBucketORM.updated_at < func.now() - older_than)
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount
+
+    def __len__(self):
+        return 0
+
+
+class RateLimiter:
+    def __init__(self, backend, rules: dict[str, str], enabled: bool = True):
+        self.backend = backend
+        self.rule_strings = dict(rules)
+        self.rules = {name: parse_rule(rule) for name, rule in rules.items()}
+        self.enabled = enabled
+        self.rejected = 0
+        self.backend_errors = 0
+
+    async def check(self, route: str, scope: str, identity: str):
+        # Returns 0 when the request may go ahead, otherwise the seconds until a token is available
+        rule = self.rules.get(f"{route}:{scope}")
+        if not self.enabled or rule is None or not identity:
+            return 0.0
+        burst, rate = rule
+        try:
+            allowed, tokens = await self.backend.take(f"{route}:{scope}:{identity}", burst, rate)
+        except (exc.SQLAlchemyError, OSError):
+            # A broken shared store must not take logins and payments down with it
+            self.backend_errors += 1
+            return 0.0
+        if allowed:
+            return 0.0
+        self.rejected += 1
+        rate_limited_requests_total.inc(route, scope)
+        return (1 - tokens) / rate
+
+    async def purge_stale(self):
+        # A bucket untouched for a day is full again, dropping it changes nothing
+        return await self.backend.purge_stale(timedelta(days=1))
+
+    def stats(self):
+        return {"enabled": self.enabled,
+                "backend": type(self.backend).__name__,
+                "rules": self.rule_strings,
+                "local_buckets": len(self.backend),
+                "rejected": self.rejected,
+                "backend_errors": self.backend_errors}
+
+
+RATE_LIMIT_BACKENDS = {
+    "memory": lambda: MemoryRateLimitBackend(settings.RATE_LIMIT_MAX_KEYS),
+    "database": DatabaseRateLimitBackend,
+}
+
+rate_limiter = RateLimiter(backend=RATE_LIMIT_BACKENDS[settings.RATE_LIMIT_BACKEND](),
+                           rules=settings.RATE_LIMITS,
+                           enabled=settings.RATE_LIMIT_ENABLED)
+
+metrics_registry.callback("rate_limit_buckets", "Token buckets held in this worker", lambda: len(rate_limiter.backend))
@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import time
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import settings
+from app.core.metrics import metrics_registry
+
+from app.db.database import async_session_factory
+
+from app.models.revoked_token import RevokedTokenORM
+
+
+class MemoryRevocationBackend:
+    # Local stand-in: revocations stay inside this process
+    shared = False
+
+    async def add(self, jti: str, expires_at: datetime):
+        pass
+
+    async def fetch_since(self, since: datetime | None):
+        return None, []
+
+    async def purge_expired(self):
+        return 0
+
+
+class DatabaseRevocationBackend:
+    shared = True
+
+    async def add(self, jti: str, expires_at: datetime):
+        async with async_session_factory() as session:
+            stmt = insert(RevokedTokenORM).values(jti=jti,
+                                                  expires_at=expires_at,
+                                                  revoked_at=func.now())
+            await session.execute(stmt.on_conflict_do_nothing(index_elements=[RevokedTokenORM.jti]))
+            await session.commit()
+
+    async def fetch_since(self, since: datetime | None):
+        # revoked_at and the returned watermark both come from the database clock,
+        # so skew between the revoking and the reading node cannot hide a revocation
+        async with async_session_factory() as session:
+            synced_at = (await session.execute(select(func.now()))).scalar_one()
+            stmt = select(RevokedTokenORM.jti, RevokedTokenORM.expires_at).where(
+                RevokedTokenORM.expires_at > synced_at)
+            if since is not None:
+                stmt = stmt.where(RevokedTokenORM.revoked_at >= since)
+            result = await session.execute(stmt)
+            return synced_at, result.all()
+
+    async def purge_expired(self):
+        async with async_session_factory() as session:
+            stmt = delete(RevokedTokenORM).where(RevokedTokenORM.expires_at <= func.now())
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount
+
+
+class RevocationStore:
+    # Re-read rows revoked shortly before the last sync so late commits are not missed
+    SYNC_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self, backend, sync_interval_seconds: float):
+        self.backend = backend
+        self.sync_interval_seconds = sync_interval_seconds
+        self._expires = {}
+        self._heap = []
+        self._last_sync = None
+        self._next_sync = 0.0
+        self._syncing = None
+
+    async def revoke(self, jti: str, expires_at: datetime):
+        self._remember(jti, expires_at.timestamp())
+        await self.backend.add(jti, expires_at)
+
+    async def is_revoked(self, jti: str) -> bool:
+        self._evict_expired()
+        if self.backend.shared and time.monotonic() >= self._next_sync:
+            await self._sync_once()
+        return jti in self._expires
+
+    async def purge_expired(self):
+        self._evict_expired()
+        return await self.backend.purge_expired()
+
+    async def _sync_once(self):
+        # Requests arriving while a sync is in flight wait for it instead of sending the same query
+        if self._syncing is None:
+            self._syncing = asyncio.ensure_future(self._sync())
+            self._syncing.add_done_callback(self._sync_done)
+        await asyncio.shield(self._syncing)
+
+    def _sync_done(self, task):
+        self._syncing = None
+
+    async def _sync(self):
+        since = self._last_sync - self.SYNC_OVERLAP if self._last_sync else None
+        synced_at, revoked = await self.backend.fetch_since(since)
+        for jti, expires_at in revoked:
+            self._remember(jti, expires_at.timestamp())
+        self._last_sync = synced_at
+        self._next_sync = time.monotonic() + self.sync_interval_seconds
+
+    def _remember(self, jti: str, expires_ts: float):
+        if expires_ts <= time.time():
+            return
+        current = self._expires.get(jti)
+        if current is None or current < expires_ts:
+            self._expires[jti] = expires_ts
+            heapq.heappush(self._heap, (expires_ts, jti))
+
+    def _evict_expired(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_ts, jti = heapq.heappop(self._heap)
+            if self._expires.get(jti) == expires_ts:
+                del self._expires[jti]
+
+    def __len__(self):
+        return len(self._expires)
+
+
+REVOCATION_BACKENDS = {
+    "memory": MemoryRevocationBackend,
+    "database": DatabaseRevocationBackend,
+}
+
+revocation_store = RevocationStore(backend=REVOCATION_BACKENDS[settings.REVOCATION_BACKEND](),
+                                   sync_interval_seconds=settings.REVOCATION_SYNC_SECONDS)
+
+metrics_registry.callback("revoked_tokens", "Unexpired token revocations known to this worker", lambda: len(revocation_store))
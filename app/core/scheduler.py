@@ -1,29 +1,150 @@
+import time
+
+from datetime import datetime, timezone
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from apscheduler.triggers.interval import IntervalTrigger
 
+from sqlalchemy import exc
+
+from app.core.idempotency import idempotency_store
+from app.core.leader import scheduler_lease
+from app.core.rate_limit import rate_limiter
+from app.core.revocation import revocation_store
+
+from app.crud.job_run import job_run_crud
+from app.crud.rollup import rollup_crud
+
 from app.services.cleanup_service import CardCleanupService
+from app.services.export_service import export_service
+from app.services.partition_service import TransactionPartitionService
+
+
+def cleanup_rows(report):
+    return sum(step["rows"] for step in report.values())
 
 
 class SchedulerManager:
 
     def __init__(self):
         self.scheduler = AsyncIOScheduler()
+        # Jobs that the newly elected leader runs right away instead of waiting a full interval
+        self.run_on_election = []
 
-    async def start_scheduler(self):
-        await CardCleanupService.perform_full_cleanup()
+    def add_job(self, func, trigger, id: str, name: str, count_rows=None, leader_only: bool = True,
+                run_on_election: bool = False):
         self.scheduler.add_job(
+            self.run_job,
+            trigger=trigger,
+            args=[id, func, count_rows, leader_only],
+            id=id,
+            replace_existing=True,
+            name=name
+        )
+        if run_on_election:
+            self.run_on_election.append(id)
+
+    async def run_job(self, job_id: str, func, count_rows, leader_only: bool):
+        if leader_only and not scheduler_lease.is_leader:
+            return
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        rows_affected = None
+        error = None
+        try:
+            result = await func()
+            if count_rows is not None:
+                rows_affected = count_rows(result)
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            try:
+                await job_run_crud.add_run(job_id, scheduler_lease.node, started_at,
+                                           time.perf_counter() - started, rows_affected, error)
+            except exc.SQLAlchemyError as e:
+                print(f"Could not record the run of {job_id}: {e!r}")
+
+    def _on_elected(self):
+        for job_id in self.run_on_election:
+            self.scheduler.modify_job(job_id, next_run_time=datetime.now())
+
+    async def start_scheduler(self):
+        # Cleanup and partition creation also run as soon as a node wins the lease, in the
+        # background; the default partition catches inserts until the new partitions exist
+        self.add_job(
             CardCleanupService.perform_full_cleanup,
             trigger=IntervalTrigger(hours = 24),
             id='daily_card_and_transaction_cleanup',
-            replace_existing=True,
-            name='Daily card expiration check and cleanup, transaction cleanup'
+            name='Daily card expiration check and cleanup, transaction cleanup',
+            count_rows=cleanup_rows,
+            run_on_election=True
+        )
+        self.add_job(
+            TransactionPartitionService.create_future_partitions,
+            trigger=IntervalTrigger(hours = 24),
+            id='daily_transaction_partition_creation',
+            name='Daily creation of upcoming monthly transaction partitions',
+            run_on_election=True
+        )
+        self.add_job(
+            rollup_crud.rebuild,
+            trigger=IntervalTrigger(hours = 24),
+            id='daily_spend_rollup_rebuild',
+            name='Daily rebuild of per-card and per-merchant spend rollups'
+        )
+        self.add_job(
+            revocation_store.purge_expired,
+            trigger=IntervalTrigger(hours = 1),
+            id='hourly_revoked_token_cleanup',
+            name='Hourly removal of expired token revocations',
+            count_rows=int,
+            # A per-process store has to be purged by every worker
+            leader_only=revocation_store.backend.shared
+        )
+
+        self.add_job(
+            rate_limiter.purge_stale,
+            trigger=IntervalTrigger(hours = 1),
+            id='hourly_rate_limit_bucket_cleanup',
+            name='Hourly removal of idle shared rate limit buckets',
+            count_rows=int
+        )
+
+        self.add_job(
+            idempotency_store.purge_expired,
+            trigger=IntervalTrigger(hours = 1),
+            id='hourly_idempotency_key_cleanup',
+            name='Hourly removal of expired idempotency keys',
+            count_rows=int
+        )
+
+        self.add_job(
+            export_service.purge_expired,
+            trigger=IntervalTrigger(hours = 1),
+            id='hourly_export_cleanup',
+            name='Hourly removal of expired export jobs and their files',
+            count_rows=int
+        )
+
+        self.add_job(
+            export_service.fail_abandoned,
+            trigger=IntervalTrigger(minutes = 5),
+            id='abandoned_export_check',
+            name='Failing export jobs whose worker stopped refreshing them',
+            count_rows=int,
+            run_on_election=True
         )
 
         self.scheduler.start()
+        scheduler_lease.on_elected.append(self._on_elected)
+        await scheduler_lease.try_acquire()
+        scheduler_lease.start()
 
     async def shutdown_scheduler(self):
         if self.scheduler.running:
             self.scheduler.shutdown()
+        await scheduler_lease.stop()
 
-scheduler_manager = SchedulerManager()
\ No newline at end of file
+scheduler_manager = SchedulerManager()
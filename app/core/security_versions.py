@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from datetime import timedelta
+
+from sqlalchemy import select, func
+
+from app.core.config import settings
+
+from app.db.database import async_session_factory
+
+from app.models.user import UserORM
+
+
+class SecurityVersionMap:
+    # Same overlap trick as the revocation store: re-read changes committed around the last sync
+    SYNC_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self, sync_interval_seconds: float):
+        self.sync_interval_seconds = sync_interval_seconds
+        # Only users whose version was ever bumped are kept, everyone else is implicitly at 0
+        self._versions = {}
+        self._last_sync = None
+        self._next_sync = 0.0
+        self._syncing = None
+
+    def note(self, user_id: int, version: int):
+        if version > self._versions.get(user_id, 0):
+            self._versions[user_id] = version
+
+    async def is_stale(self, user_id: int, token_version: int) -> bool:
+        if time.monotonic() >= self._next_sync:
+            await self._sync_once()
+        return token_version < self._versions.get(user_id, 0)
+
+    async def _sync_once(self):
+        # Requests arriving while a sync is in flight wait for it instead of sending the same query
+        if self._syncing is None:
+            self._syncing = asyncio.ensure_future(self._sync())
+            self._syncing.add_done_callback(self._sync_done)
+        await asyncio.shield(self._syncing)
+
+    def _sync_done(self, task):
+        self._syncing = None
+
+    async def _sync(self):
+        async with async_session_factory() as session:
+            sync_started = (await session.execute(select(func.now()))).scalar_one()
+            stmt = select(UserORM.id, UserORM.security_version).where(UserORM.security_version > 0)
+            if self._last_sync is not None:
+                stmt = stmt.where(UserORM.security_changed_at >= self._last_sync - self.SYNC_OVERLAP)
+            result = await session.execute(stmt)
+            for user_id, version in result.all():
+                self.note(user_id, version)
+        self._last_sync = sync_started
+        self._next_sync = time.monotonic() + self.sync_interval_seconds
+
+    def __len__(self):
+        return len(self._versions)
+
+
+security_versions = SecurityVersionMap(sync_interval_seconds=settings.SECURITY_VERSION_SYNC_SECONDS)
@@ -1,12 +1,17 @@
 from datetime import date
 
-from sqlalchemy import select
+from sqlalchemy import select, update, any_, bindparam, String
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 
-from app.db.database import async_session_factory
+from app.core.config import settings
+from app.core.metrics import instrument_queries
 
-from app.models.card import CardORM, Card, Card_In_DB
+from app.db.database import async_session_factory, read_session_factory
 
+from app.models.card import CardORM, Card, Card_In_DB, Card_import_row, CARD_COLUMNS, cards_adapter
 
+
+@instrument_queries
 class CardCRUD:
     @staticmethod
     async def add_new_card(card: Card_In_DB, carrier_id : int):
@@ -21,20 +26,58 @@ class CardCRUD:
             await session.commit()
 
     @staticmethod
-    async def get_all_cards(carrier_id : int):
+    async def add_cards_bulk(cards: list[Card_import_row], carrier_id : int):
+        if not cards:
+            return set(), {}
         async with async_session_factory() as session:
-            stmt = select(CardORM).where(CardORM.carrier_id == carrier_id)
+            numbers = bindparam("numbers", [card.number for card in cards], type_=ARRAY(String))
+            stmt = select(CardORM.number).where(CardORM.carrier_id == carrier_id, CardORM.number == any_(numbers))
+            existing_numbers = set((await session.execute(stmt)).scalars().all())
+
+            rows = [{"number": card.number,
+                     "carrier_name": card.carrier_name,
+                     "expires_date": card.expires_date,
+                     "payment_system": card.payment_system,
+                     "cvv": card.cvv,
+                     "carrier_id": carrier_id} for card in cards if card.number not in existing_numbers]
+            card_ids = {}
+            if rows:
+                stmt = (insert(CardORM)
+                        .on_conflict_do_nothing(index_elements=[CardORM.number, CardORM.carrier_id])
+                        .returning(CardORM.id, CardORM.number))
+                card_ids = {row.number: row.id for row in (await session.execute(stmt, rows)).all()}
+                await session.commit()
+            return existing_numbers, card_ids
+
+    @staticmethod
+    async def get_all_cards(carrier_id : int):
+        async with read_session_factory() as session:
+            stmt = select(*CARD_COLUMNS).where(CardORM.carrier_id == carrier_id)
             result = await session.execute(stmt)
-            cards = result.scalars().all()
-            return [Card.model_validate(card) for card in cards]
+            return cards_adapter.validate_python(result.all(), from_attributes=True)
 
     @staticmethod
-    async def get_all_existing_cards():
-        async with async_session_factory() as session:
-            stmt = select(CardORM)
+    def _all_existing_cards_stmt(after_id: int | None = None):
+        stmt = select(*CARD_COLUMNS).order_by(CardORM.id)
+        if after_id is not None:
+            stmt = stmt.where(CardORM.id > after_id)
+        return stmt
+
+    @staticmethod
+    async def get_all_existing_cards(after_id: int | None = None, limit: int | None = None):
+        async with read_session_factory() as session:
+            stmt = CardCRUD._all_existing_cards_stmt(after_id).limit(limit)
             result = await session.execute(stmt)
-            cards = result.scalars().all()
-            return [Card.model_validate(card) for card in cards]
+            return cards_adapter.validate_python(result.all(), from_attributes=True)
+
+    @staticmethod
+    async def stream_all_existing_cards(after_id: int | None = None):
+        async with read_session_factory() as session:
+            stmt = CardCRUD._all_existing_cards_stmt(after_id)
+            cards = await session.stream(stmt.execution_options(yield_per=settings.STREAM_CHUNK_SIZE))
+            async for chunk in cards.partitions():
+                for card in cards_adapter.validate_python(chunk, from_attributes=True):
+                    yield card
 
     @staticmethod
     async def get_card_by_id(id : int, carrier_id : int):
@@ -91,4 +134,15 @@ class CardCRUD:
             else:
                 return False
 
+    @staticmethod
+    async def change_card_spend_limit(id : int, carrier_id : int, spend_limit_minor : int | None):
+        async with async_session_factory() as session:
+            stmt = (update(CardORM)
+                    .where(CardORM.id == id, CardORM.carrier_id == carrier_id)
+                    .values(spend_limit_minor=spend_limit_minor)
+                    .returning(CardORM.id))
+            changed = (await session.execute(stmt)).scalar_one_or_none() is not None
+            await session.commit()
+            return changed
+
 Card_CRUD = CardCRUD()
\ No newline at end of file
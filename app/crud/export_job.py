@@ -0,0 +1,120 @@
+from datetime import datetime
+
+from sqlalchemy import select, insert, update, delete, func, or_, text
+
+from app.core.metrics import instrument_queries
+
+from app.db.database import async_session_factory
+
+from app.models.export_job import ExportJobORM, Export_job, Export_kind, Export_format, Export_status
+
+
+UNFINISHED = (Export_status.queued, Export_status.running)
+
+
+@instrument_queries
+class ExportJobCRUD:
+    # Progress is read from the primary, where the running job writes it
+    @staticmethod
+    async def add_job(kind: Export_kind, format: Export_format, requested_by: int, node: str):
+        async with async_session_factory() as session:
+            stmt = (insert(ExportJobORM)
+                    .values(kind=kind, format=format, status=Export_status.queued, requested_by=requested_by,
+                            node=node)
+                    .returning(ExportJobORM))
+            job = Export_job.model_validate((await session.execute(stmt)).scalar_one())
+            await session.commit()
+            return job
+
+    @staticmethod
+    async def get_job(id: int):
+        async with async_session_factory() as session:
+            job = await session.get(ExportJobORM, id)
+            return Export_job.model_validate(job) if job else None
+
+    @staticmethod
+    async def get_recent_jobs(requested_by: int | None = None, limit: int = 100):
+        async with async_session_factory() as session:
+            stmt = select(ExportJobORM).order_by(ExportJobORM.id.desc()).limit(limit)
+            if requested_by is not None:
+                stmt = stmt.where(ExportJobORM.requested_by == requested_by)
+            result = await session.execute(stmt)
+            return [Export_job.model_validate(job) for job in result.scalars().all()]
+
+    @staticmethod
+    async def start_job(id: int, rows_total: int | None):
+        async with async_session_factory() as session:
+            result = await session.execute(update(ExportJobORM)
+                                           .where(ExportJobORM.id == id, ExportJobORM.status == Export_status.queued)
+                                           .values(status=Export_status.running, rows_total=rows_total,
+                                                   started_at=func.now(), heartbeat_at=func.now()))
+            await session.commit()
+            return result.rowcount == 1
+
+    @staticmethod
+    async def update_progress(id: int, rows_written: int):
+        async with async_session_factory() as session:
+            await session.execute(update(ExportJobORM)
+                                  .where(ExportJobORM.id == id)
+                                  .values(rows_written=rows_written, heartbeat_at=func.now()))
+            await session.commit()
+
+    @staticmethod
+    async def touch_jobs(node: str):
+        async with async_session_factory() as session:
+            await session.execute(update(ExportJobORM)
+                                  .where(ExportJobORM.node == node, ExportJobORM.status.in_(UNFINISHED))
+                                  .values(heartbeat_at=func.now()))
+            await session.commit()
+
+    @staticmethod
+    async def fail_abandoned_jobs(before: datetime):
+        # Jobs whose worker stopped refreshing them before this moment will never finish
+        async with async_session_factory() as session:
+            result = await session.execute(update(ExportJobORM)
+                                           .where(ExportJobORM.status.in_(UNFINISHED),
+                                                  ExportJobORM.heartbeat_at < before)
+                                           .values(status=Export_status.failed,
+                                                   error="Abandoned by its worker",
+                                                   finished_at=func.now())
+                                           .returning(ExportJobORM))
+            jobs = [Export_job.model_validate(job) for job in result.scalars().all()]
+            await session.commit()
+            return jobs
+
+    @staticmethod
+    async def finish_job(id: int, rows_written: int, file_name: str | None = None, size_bytes: int | None = None,
+                         error: str | None = None):
+        async with async_session_factory() as session:
+            await session.execute(update(ExportJobORM)
+                                  .where(ExportJobORM.id == id)
+                                  .values(status=Export_status.failed if error else Export_status.succeeded,
+                                          rows_written=rows_written, file_name=file_name, size_bytes=size_bytes,
+                                          error=error, finished_at=func.now()))
+            await session.commit()
+
+    @staticmethod
+    async def delete_jobs_before(before: datetime):
+        # Returns the file names of the deleted jobs so their files can be removed too
+        async with async_session_factory() as session:
+            result = await session.execute(delete(ExportJobORM)
+                                           .where(or_(ExportJobORM.finished_at < before,
+                                                      ExportJobORM.finished_at.is_(None)
+                                                      & (ExportJobORM.created_at < before)))
+                                           .returning(ExportJobORM.file_name))
+            file_names = result.scalars().all()
+            await session.commit()
+            return file_names
+
+    @staticmethod
+    async def estimate_rows(table: str):
+        # reltuples of the table and, for a partitioned one, of its partitions; -1 means never analyzed
+        async with async_session_factory() as session:
+            result = await session.execute(text("SELECT sum(greatest(reltuples, 0))::bigint FROM pg_class "
+                                                "WHERE oid = CAST(:table AS regclass) OR oid IN "
+                                                "(SELECT inhrelid FROM pg_inherits "
+                                                "WHERE inhparent = CAST(:table AS regclass))"), {"table": table})
+            return result.scalar() or None
+
+
+export_job_crud = ExportJobCRUD()
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from sqlalchemy import select, insert
+
+from app.core.metrics import instrument_queries
+
+from app.db.database import async_session_factory, read_session_factory
+
+from app.models.scheduler import JobRunORM, Job_run
+
+
+@instrument_queries
+class JobRunCRUD:
+    @staticmethod
+    async def add_run(job_id: str, node: str, started_at: datetime, duration_seconds: float,
+                      rows_affected: int | None, error: str | None):
+        async with async_session_factory() as session:
+            await session.execute(insert(JobRunORM).values(job_id=job_id,
+                                                           node=node,
+                                                           started_at=started_at,
+                                                           duration_seconds=duration_seconds,
+                                                           rows_affected=rows_affected,
+                                                           succeeded=error is None,
+                                                           error=error))
+            await session.commit()
+
+    @staticmethod
+    async def get_recent_runs(job_id: str | None = None, limit: int = 100):
+        async with read_session_factory() as session:
+            stmt = select(JobRunORM).order_by(JobRunORM.started_at.desc()).limit(limit)
+            if job_id is not None:
+                stmt = stmt.where(JobRunORM.job_id == job_id)
+            result = await session.execute(stmt)
+            return [Job_run.model_validate(run) for run in result.scalars().all()]
+
+
+job_run_crud = JobRunCRUD()
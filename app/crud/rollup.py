@@ -0,0 +1,144 @@
+from datetime import date, timedelta
+
+from sqlalchemy import select, delete, exists, func, desc, literal_column, Date
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import settings
+from app.core.metrics import instrument_queries
+
+from app.db.database import async_session_factory, read_session_factory
+
+from app.models.card import CardORM
+from app.models.rollup import CardDailySpendORM, MerchantDailySpendORM, Spend_period, Merchant_spend
+from app.models.transaction import TransactionORM, Status
+
+
+@instrument_queries
+class SpendRollupCRUD:
+    @staticmethod
+    def upsert_statements(source, overwrite: bool = False):
+        # source has card_id, carrier_id, transaction_date, status, amount_of_money and name columns;
+        # payments add their own rows to the stored totals, a rebuild overwrites them with the full day
+        amount = source.c.amount_of_money
+        card_rows = (select(source.c.card_id, source.c.transaction_date, source.c.status,
+                            func.sum(amount), func.count(), func.min(amount), func.max(amount))
+                     .group_by(source.c.card_id, source.c.transaction_date, source.c.status))
+        card_stmt = insert(CardDailySpendORM).from_select(
+            ["card_id", "day", "status", "total_amount", "transaction_count", "min_amount", "max_amount"], card_rows)
+        card_stmt = card_stmt.on_conflict_do_update(
+            index_elements=[CardDailySpendORM.card_id, CardDailySpendORM.day, CardDailySpendORM.status],
+            set_={"total_amount": card_stmt.excluded.total_amount,
+                  "transaction_count": card_stmt.excluded.transaction_count,
+                  "min_amount": card_stmt.excluded.min_amount,
+                  "max_amount": card_stmt.excluded.max_amount} if overwrite else
+                 {"total_amount": CardDailySpendORM.total_amount + card_stmt.excluded.total_amount,
+                  "transaction_count": CardDailySpendORM.transaction_count + card_stmt.excluded.transaction_count,
+                  "min_amount": func.least(CardDailySpendORM.min_amount, card_stmt.excluded.min_amount),
+                  "max_amount": func.greatest(CardDailySpendORM.max_amount, card_stmt.excluded.max_amount)})
+
+        merchant = func.coalesce(source.c.name, literal_column("''"))
+        merchant_rows = (select(source.c.carrier_id, merchant, source.c.transaction_date, func.sum(amount), func.count())
+                         .where(source.c.status == Status.approved)
+                         .group_by(source.c.carrier_id, merchant, source.c.transaction_date))
+        merchant_stmt = insert(MerchantDailySpendORM).from_select(
+            ["carrier_id", "merchant", "day", "total_amount", "transaction_count"], merchant_rows)
+        merchant_stmt = merchant_stmt.on_conflict_do_update(
+            index_elements=[MerchantDailySpendORM.carrier_id, MerchantDailySpendORM.merchant, MerchantDailySpendORM.day],
+            set_={"total_amount": merchant_stmt.excluded.total_amount,
+                  "transaction_count": merchant_stmt.excluded.transaction_count} if overwrite else
+                 {"total_amount": MerchantDailySpendORM.total_amount + merchant_stmt.excluded.total_amount,
+                  "transaction_count": MerchantDailySpendORM.transaction_count + merchant_stmt.excluded.transaction_count})
+        return card_stmt, merchant_stmt
+
+    @staticmethod
+    def upsert_ctes(source):
+        card_stmt, merchant_stmt = SpendRollupCRUD.upsert_statements(source)
+        return card_stmt.cte("card_rollup"), merchant_stmt.cte("merchant_rollup")
+
+    @staticmethod
+    def transactions_source(since: date, until: date | None = None):
+        stmt = (select(TransactionORM.card_id, CardORM.carrier_id, TransactionORM.transaction_date,
+                       TransactionORM.status, TransactionORM.amount_of_money, TransactionORM.name)
+                .join(CardORM, CardORM.id == TransactionORM.card_id)
+                .where(TransactionORM.transaction_date >= since))
+        if until is not None:
+            stmt = stmt.where(TransactionORM.transaction_date < until)
+        return stmt.subquery("source")
+
+    @staticmethod
+    def stale_rows_statements(day: date):
+        # Rollup rows of the day whose transactions are all gone
+        card_stmt = delete(CardDailySpendORM).where(
+            CardDailySpendORM.day == day,
+            ~exists().where(TransactionORM.card_id == CardDailySpendORM.card_id,
+                            TransactionORM.transaction_date == day,
+                            TransactionORM.status == CardDailySpendORM.status))
+        merchant_stmt = delete(MerchantDailySpendORM).where(
+            MerchantDailySpendORM.day == day,
+            ~exists().where(CardORM.id == TransactionORM.card_id,
+                            CardORM.carrier_id == MerchantDailySpendORM.carrier_id,
+                            func.coalesce(TransactionORM.name, literal_column("''")) == MerchantDailySpendORM.merchant,
+                            TransactionORM.transaction_date == day,
+                            TransactionORM.status == Status.approved))
+        return card_stmt, merchant_stmt
+
+    @staticmethod
+    async def rebuild(since: date | None = None, until: date | None = None):
+        # Rollups outlive the raw rows, so only days still covered by the transactions table are rebuilt.
+        # Payments keep adding to today's rows, so the rebuild stops before today and never waits on them;
+        # every day is rewritten in its own short transaction with overwriting upserts
+        if since is None:
+            since = date.today() - timedelta(days=settings.TRANSACTION_RETENTION_DAYS)
+        if until is None:
+            until = date.today()
+        day = since
+        while day < until:
+            next_day = day + timedelta(days=1)
+            async with async_session_factory() as session:
+                source = SpendRollupCRUD.transactions_source(day, next_day)
+                for stmt in (*SpendRollupCRUD.upsert_statements(source, overwrite=True),
+                             *SpendRollupCRUD.stale_rows_statements(day)):
+                    await session.execute(stmt)
+                await session.commit()
+            day = next_day
+
+    @staticmethod
+    async def get_card_spend(card_id: int, period: str, date_from: date | None = None, date_to: date | None = None):
+        async with read_session_factory() as session:
+            period_start = func.date_trunc(period, CardDailySpendORM.day).cast(Date)
+            stmt = (select(period_start.label("period_start"),
+                           CardDailySpendORM.status,
+                           func.sum(CardDailySpendORM.total_amount).label("total_amount"),
+                           func.sum(CardDailySpendORM.transaction_count).label("transaction_count"),
+                           func.min(CardDailySpendORM.min_amount).label("min_amount"),
+                           func.max(CardDailySpendORM.max_amount).label("max_amount"))
+                    .where(CardDailySpendORM.card_id == card_id)
+                    .group_by(period_start, CardDailySpendORM.status)
+                    .order_by(period_start, CardDailySpendORM.status))
+            if date_from is not None:
+                stmt = stmt.where(CardDailySpendORM.day >= date_from)
+            if date_to is not None:
+                stmt = stmt.where(CardDailySpendORM.day <= date_to)
+            result = await session.execute(stmt)
+            return [Spend_period.model_validate(dict(row._mapping)) for row in result.all()]
+
+    @staticmethod
+    async def get_top_merchants(carrier_id: int, limit: int, date_from: date | None = None, date_to: date | None = None):
+        async with read_session_factory() as session:
+            total_amount = func.sum(MerchantDailySpendORM.total_amount)
+            stmt = (select(MerchantDailySpendORM.merchant,
+                           total_amount.label("total_amount"),
+                           func.sum(MerchantDailySpendORM.transaction_count).label("transaction_count"))
+                    .where(MerchantDailySpendORM.carrier_id == carrier_id)
+                    .group_by(MerchantDailySpendORM.merchant)
+                    .order_by(desc(total_amount))
+                    .limit(limit))
+            if date_from is not None:
+                stmt = stmt.where(MerchantDailySpendORM.day >= date_from)
+            if date_to is not None:
+                stmt = stmt.where(MerchantDailySpendORM.day <= date_to)
+            result = await session.execute(stmt)
+            return [Merchant_spend.model_validate(dict(row._mapping)) for row in result.all()]
+
+
+rollup_crud = SpendRollupCRUD()
@@ -1,42 +1,353 @@
-from sqlalchemy import select
+import asyncio
 
-from app.db.database import async_session_factory
+from datetime import date, datetime
 
-from app.models.transaction import TransactionORM ,Transaction
+from sqlalchemy import select, update, literal, true, any_, bindparam, case, or_, tuple_, text, exc, Integer, BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 
+from app.core.config import settings
+from app.core.metrics import instrument_queries, metrics_registry
 
+from app.db.database import async_session_factory, read_session_factory
+from app.db.group_commit import GroupCommitBuffer
+from app.db.retry import run_with_retry
+
+from app.crud.rollup import SpendRollupCRUD
+
+from app.models.card import CardORM
+from app.models.ledger import CardLedgerORM, to_minor_units
+from app.models.transaction import TransactionORM ,Transaction, Status, Payment, Payment_result, Payment_outcome
+from app.models.transaction import TRANSACTION_COLUMNS, transactions_adapter, Transaction_search, Transaction_sort
+
+
+metrics_registry.callback("group_commit_queue_depth", "Transaction inserts waiting for the next group commit",
+                          lambda: len(transaction_buffer._pending))
+metrics_registry.callback("group_commit_flushes_total", "Group commit flushes",
+                          lambda: transaction_buffer.flush_count, "counter")
+metrics_registry.callback("group_commit_rows_total", "Rows committed through group commit",
+                          lambda: transaction_buffer.rows_flushed, "counter")
+metrics_registry.callback("group_commit_flush_seconds_total", "Time spent in group commit flushes",
+                          lambda: transaction_buffer.flush_seconds_total, "counter")
+
+
+# Sort column and whether it is descending; id breaks ties so the keyset cursor is unique
+SEARCH_ORDER = {
+    Transaction_sort.newest: (TransactionORM.transaction_date, True),
+    Transaction_sort.oldest: (TransactionORM.transaction_date, False),
+    Transaction_sort.largest: (TransactionORM.amount_of_money, True),
+    Transaction_sort.smallest: (TransactionORM.amount_of_money, False),
+}
+QUERY_CANCELED = "57014"
+
+# Payment_result.detail of every outcome that is not a plain approval
+PAYMENT_DETAILS = {
+    Payment_outcome.card_not_found: "There is no card with this id",
+    Payment_outcome.card_frozen: "This card is frozen",
+    Payment_outcome.card_expired: "This card has expired",
+    Payment_outcome.limit_exceeded: "This payment exceeds the card's spend limit",
+}
+
+search_slots = asyncio.Semaphore(settings.TRANSACTION_SEARCH_MAX_CONCURRENCY)
+
+
+ROLLUP_COLUMNS = (TransactionORM.id, TransactionORM.card_id, TransactionORM.transaction_date,
+                  TransactionORM.status, TransactionORM.amount_of_money, TransactionORM.name)
+
+
+@instrument_queries
 class TransactionCRUD:
 
     @staticmethod
-    async def add_new_transaction(transaction: Transaction, c_id: int):
-        async with async_session_factory() as session:
-            new_transaction = TransactionORM(amount_of_money=transaction.amount_of_money,
-                                             name=transaction.name,
-                                             transaction_date=transaction.transaction_date,
-                                             transaction_time=transaction.transaction_time,
-                                             status=transaction.status,
-                                             card_id=c_id
-                                             )
-            session.add(new_transaction)
-            await session.commit()
+    def _rollup_source(inserted, carrier_id):
+        return select(inserted.c.card_id, carrier_id.label("carrier_id"), inserted.c.transaction_date,
+                      inserted.c.status, inserted.c.amount_of_money, inserted.c.name).subquery("source")
 
+    @staticmethod
+    def _authorize_payment_stmt(card_id: int, carrier_id: int, money_amount: float, company_name: str):
+        # WITH card AS (SELECT ... WHERE id = ? AND carrier_id = ? FOR UPDATE),
+        #      inserted AS (INSERT ... SELECT ..., CASE WHEN within limit THEN approved ELSE declined END
+        #                   FROM card WHERE NOT frozen AND expires_date >= today RETURNING ...),
+        #      posting AS (INSERT INTO card_ledger ... FROM card JOIN inserted WHERE approved),
+        #      balance AS (UPDATE cards SET balance_minor = balance_minor + ? FROM inserted WHERE approved)
+        # SELECT card.frozen, card.expires_date, inserted.id, inserted.status FROM card LEFT JOIN inserted ON true
+        # The row lock serializes payments per card, so the limit check only reads the balance snapshot
+        today = date.today()
+        amount_minor = literal(to_minor_units(money_amount), BigInteger)
+        card = (select(CardORM.id, CardORM.frozen, CardORM.expires_date,
+                       CardORM.balance_minor, CardORM.spend_limit_minor)
+                .where(CardORM.id == card_id, CardORM.carrier_id == carrier_id)
+                .with_for_update()
+                .cte("card"))
+        within_limit = or_(card.c.spend_limit_minor.is_(None),
+                           card.c.balance_minor + amount_minor <= card.c.spend_limit_minor)
+        status = case((within_limit, literal(Status.approved, TransactionORM.status.type)),
+                      else_=literal(Status.declined, TransactionORM.status.type))
+        authorized = (select(literal(money_amount, TransactionORM.amount_of_money.type),
+                             literal(company_name, TransactionORM.name.type),
+                             literal(today, TransactionORM.transaction_date.type),
+                             literal(datetime.now().time(), TransactionORM.transaction_time.type),
+                             status,
+                             card.c.id)
+                      .where(card.c.frozen == False, card.c.expires_date >= today))
+        inserted = (insert(TransactionORM)
+                    .from_select(["amount_of_money", "name", "transaction_date", "transaction_time", "status", "card_id"],
+                                 authorized)
+                    .returning(*ROLLUP_COLUMNS)
+                    .cte("inserted"))
+        approved = inserted.c.status == Status.approved
+        posting = (insert(CardLedgerORM)
+                   .from_select(["card_id", "transaction_id", "amount_minor", "balance_after_minor"],
+                                select(card.c.id, inserted.c.id, amount_minor, card.c.balance_minor + amount_minor)
+                                .select_from(card.join(inserted, true()))
+                                .where(approved))
+                   .cte("posting"))
+        balance = (update(CardORM)
+                   .where(CardORM.id == inserted.c.card_id, approved)
+                   .values(balance_minor=CardORM.balance_minor + amount_minor)
+                   .cte("balance"))
+        source = TransactionCRUD._rollup_source(inserted, literal(carrier_id, Integer))
+        return (select(card.c.frozen, card.c.expires_date,
+                       inserted.c.id.label("transaction_id"), inserted.c.status)
+                .select_from(card.outerjoin(inserted, true()))
+                .add_cte(posting, balance, *SpendRollupCRUD.upsert_ctes(source)))
+
+    @staticmethod
+    async def authorize_payment(card_id: int, carrier_id: int, money_amount: float, company_name: str,
+                                session=None):
+        stmt = TransactionCRUD._authorize_payment_stmt(card_id, carrier_id, money_amount, company_name)
+        if session is not None:
+            # Joins the caller's transaction, which commits it and retries it as a whole
+            return TransactionCRUD._payment_outcome((await session.execute(stmt)).first())
+
+        if settings.GROUP_COMMIT_ENABLED:
+            payment = Payment(card_id=card_id, money_amount=money_amount, company_name=company_name)
+            outcome = await transaction_buffer.submit((payment, carrier_id))
+            # The flush commits in the context of whichever payment started it
+            read_session_factory.pin()
+            return outcome
+
+        async def execute():
+            async with async_session_factory() as session:
+                row = (await session.execute(stmt)).first()
+                await session.commit()
+                return row
+        return TransactionCRUD._payment_outcome(await run_with_retry(execute))
 
     @staticmethod
-    async def get_all_transactions_by_card_id(card_id : str):
+    def _payment_outcome(row):
+        if row is None:
+            return Payment_outcome.card_not_found, None
+        if row.transaction_id is not None:
+            if row.status == Status.declined:
+                return Payment_outcome.limit_exceeded, row.transaction_id
+            return Payment_outcome.approved, row.transaction_id
+        if row.frozen:
+            return Payment_outcome.card_frozen, None
+        return Payment_outcome.card_expired, None
+
+
+    @staticmethod
+    async def add_payments_batch(payments: list[Payment], carrier_id: int):
+        outcomes = await run_with_retry(
+            lambda: TransactionCRUD.authorize_payments([(payment, carrier_id) for payment in payments]))
+        return [Payment_result(index=index,
+                               card_id=payment.card_id,
+                               accepted=outcome == Payment_outcome.approved,
+                               transaction_id=transaction_id,
+                               detail=PAYMENT_DETAILS.get(outcome))
+                for index, (payment, (outcome, transaction_id)) in enumerate(zip(payments, outcomes))]
+
+    @staticmethod
+    async def authorize_payments(payments: list[tuple[Payment, int]]):
+        # Takes (payment, carrier_id) pairs and returns (outcome, transaction_id) for each, in order.
+        # The batch costs the same handful of statements whatever its size, all in one transaction.
         async with async_session_factory() as session:
-            stmt = select(TransactionORM).where(TransactionORM.card_id == card_id)
+            # Cards are locked in id order so two concurrent batches cannot deadlock on each other
+            stmt = (select(CardORM.id, CardORM.carrier_id, CardORM.frozen, CardORM.expires_date,
+                           CardORM.balance_minor, CardORM.spend_limit_minor)
+                    .where(CardORM.id.in_({payment.card_id for payment, _ in payments}))
+                    .order_by(CardORM.id)
+                    .with_for_update())
+            cards = {card.id: card for card in (await session.execute(stmt)).all()}
+            balances = {card.id: card.balance_minor for card in cards.values()}
+
+            today = date.today()
+            now = datetime.now().time()
+            outcomes = []
+            # Approved and declined payments both become transactions, only approved ones are posted
+            recorded = []
+            rows = []
+            postings = []
+            for payment, carrier_id in payments:
+                card = cards.get(payment.card_id)
+                if card is None or card.carrier_id != carrier_id:
+                    outcomes.append((Payment_outcome.card_not_found, None))
+                    continue
+                if card.frozen:
+                    outcomes.append((Payment_outcome.card_frozen, None))
+                    continue
+                if card.expires_date < today:
+                    outcomes.append((Payment_outcome.card_expired, None))
+                    continue
+
+                amount_minor = to_minor_units(payment.money_amount)
+                balance_after = balances[card.id] + amount_minor
+                if card.spend_limit_minor is None or balance_after <= card.spend_limit_minor:
+                    outcome = Payment_outcome.approved
+                    balances[card.id] = balance_after
+                    postings.append((len(outcomes), {"card_id": card.id,
+                                                     "amount_minor": amount_minor,
+                                                     "balance_after_minor": balance_after}))
+                else:
+                    outcome = Payment_outcome.limit_exceeded
+                recorded.append(len(outcomes))
+                outcomes.append((outcome, None))
+                rows.append({"amount_of_money": payment.money_amount,
+                             "name": payment.company_name,
+                             "transaction_date": today,
+                             "transaction_time": now,
+                             "status": Status.approved if outcome == Payment_outcome.approved else Status.declined,
+                             "card_id": payment.card_id})
+
+            if rows:
+                stmt = insert(TransactionORM).returning(TransactionORM.id, sort_by_parameter_order=True)
+                transaction_ids = (await session.execute(stmt, rows)).scalars().all()
+                for position, transaction_id in zip(recorded, transaction_ids):
+                    outcomes[position] = (outcomes[position][0], transaction_id)
+
+                if postings:
+                    await session.execute(insert(CardLedgerORM), [dict(posting, transaction_id=outcomes[position][1])
+                                                                  for position, posting in postings])
+                    await session.execute(update(CardORM), [{"id": card_id, "balance_minor": balance}
+                                                            for card_id, balance in balances.items()
+                                                            if balance != cards[card_id].balance_minor])
+
+                batch = (select(TransactionORM.card_id, CardORM.carrier_id, TransactionORM.transaction_date,
+                                TransactionORM.status, TransactionORM.amount_of_money, TransactionORM.name)
+                         .join(CardORM, CardORM.id == TransactionORM.card_id)
+                         .where(TransactionORM.id == any_(bindparam("ids", transaction_ids, type_=ARRAY(Integer))),
+                                TransactionORM.transaction_date == today)
+                         .subquery("source"))
+                for rollup_stmt in SpendRollupCRUD.upsert_statements(batch):
+                    await session.execute(rollup_stmt)
+                await session.commit()
+
+            return outcomes
+
+
+    @staticmethod
+    async def get_all_transactions_by_card_id(card_id : str, date_from: date | None = None, date_to: date | None = None):
+        async with read_session_factory() as session:
+            stmt = select(*TRANSACTION_COLUMNS).where(TransactionORM.card_id == card_id)
+            # Bounds on the partition key let Postgres skip whole monthly partitions
+            if date_from is not None:
+                stmt = stmt.where(TransactionORM.transaction_date >= date_from)
+            if date_to is not None:
+                stmt = stmt.where(TransactionORM.transaction_date <= date_to)
             result = await session.execute(stmt)
-            transactions = result.scalars().all()
-            return [Transaction.model_validate(transaction) for transaction in transactions]
+            return transactions_adapter.validate_python(result.all(), from_attributes=True)
 
 
     @staticmethod
-    async def get_all_transactions():
-        async with async_session_factory() as session:
-            stmt = select(TransactionORM)
+    def _all_transactions_stmt(after_id: int | None = None):
+        stmt = select(*TRANSACTION_COLUMNS).order_by(TransactionORM.id)
+        if after_id is not None:
+            stmt = stmt.where(TransactionORM.id > after_id)
+        return stmt
+
+    @staticmethod
+    async def get_all_transactions(after_id: int | None = None, limit: int | None = None):
+        async with read_session_factory() as session:
+            stmt = TransactionCRUD._all_transactions_stmt(after_id).limit(limit)
             result = await session.execute(stmt)
-            transactions = result.scalars().all()
-            return [Transaction.model_validate(transaction) for transaction in transactions]
+            return transactions_adapter.validate_python(result.all(), from_attributes=True)
+
+    @staticmethod
+    async def stream_all_transactions(after_id: int | None = None):
+        async with read_session_factory() as session:
+            stmt = TransactionCRUD._all_transactions_stmt(after_id)
+            transactions = await session.stream(stmt.execution_options(yield_per=settings.STREAM_CHUNK_SIZE))
+            async for chunk in transactions.partitions():
+                for transaction in transactions_adapter.validate_python(chunk, from_attributes=True):
+                    yield transaction
+
+    @staticmethod
+    def search_cursor(transaction: Transaction, sort: Transaction_sort):
+        column, _ = SEARCH_ORDER[sort]
+        value = getattr(transaction, column.key)
+        return [value.isoformat() if isinstance(value, date) else value, transaction.id]
+
+    @staticmethod
+    def _search_after(after: list, column):
+        # Raises ValueError unless the cursor was made by search_cursor for this sort column
+        if len(after) != 2:
+            raise ValueError("Invalid cursor")
+        after_value, after_id = after
+        if type(after_id) is not int:
+            raise ValueError("Invalid cursor")
+        if column is TransactionORM.transaction_date:
+            if not isinstance(after_value, str):
+                raise ValueError("Invalid cursor")
+            return date.fromisoformat(after_value), after_id
+        if type(after_value) not in (int, float):
+            raise ValueError("Invalid cursor")
+        return float(after_value), after_id
+
+    @staticmethod
+    def _search_stmt(search: Transaction_search, after: list | None, limit: int):
+        stmt = select(*TRANSACTION_COLUMNS)
+        # The plain date bound is what lets Postgres prune partitions; a bound given as a date covers the whole day
+        if isinstance(search.date_from, datetime):
+            stmt = stmt.where(TransactionORM.transaction_date >= search.date_from.date(),
+                              tuple_(TransactionORM.transaction_date, TransactionORM.transaction_time)
+                              >= tuple_(search.date_from.date(), search.date_from.time()))
+        elif search.date_from is not None:
+            stmt = stmt.where(TransactionORM.transaction_date >= search.date_from)
+        if isinstance(search.date_to, datetime):
+            stmt = stmt.where(TransactionORM.transaction_date <= search.date_to.date(),
+                              tuple_(TransactionORM.transaction_date, TransactionORM.transaction_time)
+                              <= tuple_(search.date_to.date(), search.date_to.time()))
+        elif search.date_to is not None:
+            stmt = stmt.where(TransactionORM.transaction_date <= search.date_to)
+        if search.amount_min is not None:
+            stmt = stmt.where(TransactionORM.amount_of_money >= search.amount_min)
+        if search.amount_max is not None:
+            stmt = stmt.where(TransactionORM.amount_of_money <= search.amount_max)
+        if search.status is not None:
+            stmt = stmt.where(TransactionORM.status == search.status)
+        if search.merchant:
+            stmt = stmt.where(TransactionORM.name.startswith(search.merchant, autoescape=True))
+        if search.card_id is not None:
+            stmt = stmt.where(TransactionORM.card_id == search.card_id)
+        if search.user_id is not None:
+            stmt = stmt.where(TransactionORM.card_id.in_(select(CardORM.id).where(CardORM.carrier_id == search.user_id)))
+
+        column, descending = SEARCH_ORDER[search.sort]
+        if after is not None:
+            after_value, after_id = TransactionCRUD._search_after(after, column)
+            key = tuple_(column, TransactionORM.id)
+            bound = tuple_(after_value, after_id)
+            stmt = stmt.where(key < bound if descending else key > bound)
+        if descending:
+            stmt = stmt.order_by(column.desc(), TransactionORM.id.desc())
+        else:
+            stmt = stmt.order_by(column, TransactionORM.id)
+        return stmt.limit(limit)
+
+    @staticmethod
+    async def search_transactions(search: Transaction_search, after: list | None = None, limit: int = 100):
+        # Returns None when the search ran past TRANSACTION_SEARCH_TIMEOUT_MS
+        stmt = TransactionCRUD._search_stmt(search, after, limit)
+        async with search_slots:
+            async with read_session_factory() as session:
+                await session.execute(text(f"SET LOCAL statement_timeout = {int(settings.TRANSACTION_SEARCH_TIMEOUT_MS)}"))
+                try:
+                    result = await session.execute(stmt)
+                except exc.DBAPIError as e:
+                    if getattr(e.orig, "sqlstate", None) == QUERY_CANCELED:
+                        return None
+                    raise
+                return transactions_adapter.validate_python(result.all(), from_attributes=True)
 
     @staticmethod
     async def get_transaction_by_id(transaction_id: int):
@@ -62,4 +373,9 @@ class TransactionCRUD:
                 return True
 
 
-transaction_crud = TransactionCRUD()
\ No newline at end of file
+transaction_crud = TransactionCRUD()
+
+# Single payments are authorized together, one authorize_payments transaction per flush
+transaction_buffer = GroupCommitBuffer(TransactionCRUD.authorize_payments,
+                                       max_rows=settings.GROUP_COMMIT_MAX_ROWS,
+                                       max_delay_ms=settings.GROUP_COMMIT_MAX_DELAY_MS)
\ No newline at end of file
@@ -1,14 +1,35 @@
-from sqlalchemy import select
+from datetime import datetime, timedelta, timezone
 
-from app.core.security import pwd_context
+from sqlalchemy import select, func
 
-from app.db.database import async_session_factory
+from app.core.cache import principal_cache
+from app.core.config import settings
+from app.core.hashing import password_hasher
+from app.core.metrics import instrument_queries
+from app.core.revocation import revocation_store
+from app.core.security_versions import security_versions
 
-from app.models.user import User, User_In_DB, UserORM
+from app.db.database import async_session_factory, read_session_factory
 
+from app.models.user import User_In_DB, UserORM, USER_COLUMNS, users_adapter
 
+
+@instrument_queries
 class UserCRUD:
 
+    @staticmethod
+    def _bump_security_version(user: UserORM):
+        user.security_version += 1
+        # Stamped by the database clock, which every worker's sync watermark also comes from
+        user.security_changed_at = func.now()
+        return user.id, user.security_version
+
+    @staticmethod
+    async def _revoke_all_tokens(user_id: int):
+        # A deleted user has no row left to carry a security version
+        expires_at = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        await revocation_store.revoke(f"user:{user_id}", expires_at)
+
     @staticmethod
     async def add_new_user(user: User_In_DB):
         async with async_session_factory() as session:
@@ -47,12 +68,27 @@ class UserCRUD:
             return user.first()
 
     @staticmethod
-    async def select_all_users():
-        async with async_session_factory() as session:
-            stmt = select(UserORM)
+    def _all_users_stmt(after_id: int | None = None):
+        stmt = select(*USER_COLUMNS).order_by(UserORM.id)
+        if after_id is not None:
+            stmt = stmt.where(UserORM.id > after_id)
+        return stmt
+
+    @staticmethod
+    async def select_all_users(after_id: int | None = None, limit: int | None = None):
+        async with read_session_factory() as session:
+            stmt = UserCRUD._all_users_stmt(after_id).limit(limit)
             result = await session.execute(stmt)
-            users = result.scalars().all()
-            return [User.model_validate(user) for user in users]
+            return users_adapter.validate_python(result.all(), from_attributes=True)
+
+    @staticmethod
+    async def stream_all_users(after_id: int | None = None):
+        async with read_session_factory() as session:
+            stmt = UserCRUD._all_users_stmt(after_id)
+            users = await session.stream(stmt.execution_options(yield_per=settings.STREAM_CHUNK_SIZE))
+            async for chunk in users.partitions():
+                for user in users_adapter.validate_python(chunk, from_attributes=True):
+                    yield user
 
     @staticmethod
     async def delete_account_by_username(username : str):
@@ -62,8 +98,12 @@ class UserCRUD:
             user = result.scalar()
 
             if user:
+                email = user.email
+                user_id = user.id
                 await session.delete(user)
                 await session.commit()
+                principal_cache.invalidate(email)
+                await UserCRUD._revoke_all_tokens(user_id)
                 return True
             else:
                 return False
@@ -76,8 +116,12 @@ class UserCRUD:
             user = result.scalar()
 
             if user:
+                email = user.email
+                user_id = user.id
                 await session.delete(user)
                 await session.commit()
+                principal_cache.invalidate(email)
+                await UserCRUD._revoke_all_tokens(user_id)
                 return True
             else:
                 return False
@@ -90,8 +134,12 @@ class UserCRUD:
             user = result.scalar()
 
             if user:
+                email = user.email
                 user.disabled = not user.disabled
+                user_id, version = UserCRUD._bump_security_version(user)
                 await session.commit()
+                principal_cache.invalidate(email)
+                security_versions.note(user_id, version)
                 return True
             else:
                 return False
@@ -104,8 +152,12 @@ class UserCRUD:
             user = result.scalar()
 
             if user:
+                email = user.email
                 user.role = role
+                user_id, version = UserCRUD._bump_security_version(user)
                 await session.commit()
+                principal_cache.invalidate(email)
+                security_versions.note(user_id, version)
                 return True
             else:
                 return False
@@ -134,7 +186,7 @@ class UserCRUD:
             if new_username is not None:
                 updates['username'] = new_username
             if new_password is not None:
-                updates['hashed_password'] = pwd_context.hash(new_password)
+                updates['hashed_password'] = await password_hasher.hash(new_password)
 
             if new_email is not None:
                 updates['email'] = new_email
@@ -149,10 +201,19 @@ class UserCRUD:
             if new_address is not None:
                 updates['address'] = new_address
 
+            old_email = user.email
+
             for field, value in updates.items():
                 setattr(user, field, value)
 
+            bumped = None
+            if {'username', 'hashed_password', 'email'} & updates.keys():
+                bumped = UserCRUD._bump_security_version(user)
+
             await session.commit()
+            principal_cache.invalidate(old_email, new_email)
+            if bumped:
+                security_versions.note(*bumped)
             return True
 
 
@@ -1,16 +1,193 @@
+import asyncio
+import time
+
+from contextvars import ContextVar
+
+from sqlalchemy import event, exc, text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import  DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from  app.core.cache import TTLCache
 from  app.core.config import settings
+from app.core.metrics import install_query_timing, metrics_registry
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        # Time spent here is time a request waited for a free connection (or for a new one to open)
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def stats(self):
+        return {"size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_seconds": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                "max_wait_seconds": self.wait_seconds_max}
+
+
+def create_engine(url: str):
+    engine = create_async_engine(
+        url = url,
+        poolclass = InstrumentedPool,
+        pool_size = settings.DB_POOL_SIZE,
+        max_overflow = settings.DB_MAX_OVERFLOW,
+        pool_timeout = settings.DB_POOL_TIMEOUT,
+        pool_recycle = settings.DB_POOL_RECYCLE,
+        pool_pre_ping = settings.DB_POOL_PRE_PING,
+        connect_args = {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+                        "command_timeout": settings.DB_COMMAND_TIMEOUT},
+    )
+    install_query_timing(engine)
+    return engine
+
+
+async def warm_up_pool(engine, connections: int):
+    # Open the connections before the app reports ready, then hand them back to the pool
+    opened = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+    for conn in opened:
+        await conn.close()
+
+
+async def check_database(engine, timeout: float):
+    try:
+        async with asyncio.timeout(timeout):
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        return True
+    except (exc.SQLAlchemyError, OSError, asyncio.TimeoutError):
+        return False
+
+
+class ReplicaRouter:
+    LAG_QUERY = text("SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                     "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END")
 
+    def __init__(self, urls: list[str], primary_session_factory, pin_seconds: float, max_pinned: int):
+        self.engines = [create_engine(url) for url in urls]
+        self.session_factories = [async_sessionmaker(engine) for engine in self.engines]
+        self.primary_session_factory = primary_session_factory
+        # Replicas take reads only after their first check passes; until then reads go to the primary
+        self.healthy = [False] * len(self.engines)
+        self.lag_seconds = [None] * len(self.engines)
+        self.fallbacks = 0
+        self.pinned_reads = 0
+        self._next = 0
+        self._task = None
+        # Read-your-writes: whoever committed to the primary reads from it for pin_seconds afterwards
+        self.principal = ContextVar("read_principal", default=None)
+        self._pinned = TTLCache(max_size=max_pinned, ttl_seconds=pin_seconds)
 
-async_engine = create_async_engine(
-    url = settings.DATABASE_URL_asyncpg,
-    pool_size = 5,
-    max_overflow = 10,
-)
+    def pin(self, principal=None):
+        principal = principal if principal is not None else self.principal.get()
+        if principal is not None and self.engines:
+            self._pinned.set(principal, True)
+
+    def __call__(self):
+        principal = self.principal.get()
+        if principal is not None and self._pinned.get(principal) is not None:
+            self.pinned_reads += 1
+            return self.primary_session_factory()
+        healthy = [index for index, is_healthy in enumerate(self.healthy) if is_healthy]
+        if not healthy:
+            if self.engines:
+                self.fallbacks += 1
+            return self.primary_session_factory()
+        self._next += 1
+        return self.session_factories[healthy[self._next % len(healthy)]]()
+
+    async def check_replica(self, index: int):
+        try:
+            async with asyncio.timeout(settings.HEALTH_CHECK_TIMEOUT_SECONDS):
+                async with self.engines[index].connect() as conn:
+                    lag = (await conn.execute(self.LAG_QUERY)).scalar()
+            self.lag_seconds[index] = float(lag or 0)
+            self.healthy[index] = self.lag_seconds[index] <= settings.DB_REPLICA_MAX_LAG_SECONDS
+        except (exc.SQLAlchemyError, OSError, asyncio.TimeoutError):
+            self.lag_seconds[index] = None
+            self.healthy[index] = False
+
+    async def check_replicas(self):
+        # Probed together, so one unreachable replica costs at most one timeout per round
+        await asyncio.gather(*(self.check_replica(index) for index in range(len(self.engines))))
+
+    async def _check_forever(self):
+        while True:
+            await self.check_replicas()
+            await asyncio.sleep(settings.DB_REPLICA_CHECK_SECONDS)
+
+    def start(self):
+        if self.engines and self._task is None:
+            self._task = asyncio.create_task(self._check_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for engine in self.engines:
+            await engine.dispose()
+
+    def stats(self):
+        return {"replicas": [{"healthy": healthy, "lag_seconds": lag, "pool": engine.pool.stats()}
+                             for healthy, lag, engine in zip(self.healthy, self.lag_seconds, self.engines)],
+                "fallbacks_to_primary": self.fallbacks,
+                "pinned_principals": len(self._pinned._entries),
+                "pinned_reads": self.pinned_reads}
+
+
+async_engine = create_engine(settings.DATABASE_URL_asyncpg)
 
 async_session_factory = async_sessionmaker(async_engine)
 
+# Read-only queries that tolerate replication lag; anything feeding a write stays on async_session_factory
+read_session_factory = ReplicaRouter(settings.DATABASE_REPLICA_URLS_asyncpg, async_session_factory,
+                                     pin_seconds=settings.DB_READ_YOUR_WRITES_SECONDS,
+                                     max_pinned=settings.PRINCIPAL_CACHE_SIZE)
+
+
+@event.listens_for(async_engine.sync_engine, "commit")
+def pin_committing_principal(conn):
+    read_session_factory.pin()
+
+
+metrics_registry.callback("db_pool_checked_out", "Connections currently checked out of the primary pool",
+                          lambda: async_engine.pool.checkedout())
+metrics_registry.callback("db_pool_overflow", "Overflow connections open beyond the primary pool size",
+                          lambda: max(async_engine.pool.overflow(), 0))
+metrics_registry.callback("db_pool_checkouts_total", "Connection checkouts from the primary pool",
+                          lambda: async_engine.pool.checkouts, "counter")
+metrics_registry.callback("db_pool_timeouts_total", "Checkouts from the primary pool that timed out",
+                          lambda: async_engine.pool.timeouts, "counter")
+metrics_registry.callback("db_pool_wait_seconds_total", "Time spent waiting for a primary pool connection",
+                          lambda: async_engine.pool.wait_seconds_total, "counter")
+metrics_registry.callback("db_replica_lag_seconds", "Replication lag of each read replica",
+                          lambda: {(str(index),): lag for index, lag in enumerate(read_session_factory.lag_seconds)},
+                          labelnames=("replica",))
+metrics_registry.callback("db_replica_pinned_reads_total", "Reads kept on the primary right after the same user wrote",
+                          lambda: read_session_factory.pinned_reads, "counter")
+metrics_registry.callback("db_replica_fallbacks_total", "Reads sent to the primary because no replica was healthy",
+                          lambda: read_session_factory.fallbacks, "counter")
+
 class Base(DeclarativeBase):
-    pass
\ No newline at end of file
+    pass
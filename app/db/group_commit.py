@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from app.core.metrics import query_label
+
+from app.db.retry import run_with_retry
+
+
+class GroupCommitBuffer:
+    def __init__(self, flush_batch, max_rows: int, max_delay_ms: float):
+        # flush_batch(items) handles the whole batch in one transaction and returns a result per item
+        self.flush_batch = flush_batch
+        self.max_rows = max_rows
+        self.max_delay_ms = max_delay_ms
+        self._pending = []
+        self._timer = None
+        self._flushes = set()
+        self.flush_count = 0
+        self.rows_flushed = 0
+        self.last_flush_rows = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    async def submit(self, item):
+        # Resolves with the item's result once its whole batch is committed
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_rows:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay_ms / 1000, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        query_label.set("GroupCommitBuffer.flush")
+        started = time.perf_counter()
+        items = [item for item, _ in batch]
+        try:
+            # The batch is one transaction, so after a deadlock or serialization failure it is simply run again
+            results = await run_with_retry(lambda: self.flush_batch(items))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+        elapsed = time.perf_counter() - started
+        self.flush_count += 1
+        self.rows_flushed += len(batch)
+        self.last_flush_rows = len(batch)
+        self.flush_seconds_total += elapsed
+        self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+
+    async def close(self):
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def stats(self):
+        return {"max_rows": self.max_rows,
+                "max_delay_ms": self.max_delay_ms,
+                "queue_depth": len(self._pending),
+                "flushes_in_flight": len(self._flushes),
+                "flush_count": self.flush_count,
+                "rows_flushed": self.rows_flushed,
+                "last_flush_rows": self.last_flush_rows,
+                "avg_flush_rows": self.rows_flushed / self.flush_count if self.flush_count else 0.0,
+                "avg_flush_seconds": self.flush_seconds_total / self.flush_count if self.flush_count else 0.0,
+                "max_flush_seconds": self.flush_seconds_max}
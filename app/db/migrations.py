@@ -0,0 +1,227 @@
+from datetime import date
+
+from sqlalchemy import select, exists, func, text, BigInteger
+
+from app.db.database import Base, async_engine
+
+# Every model has to be imported so that Base.metadata knows about its table
+from app.models import user, card, transaction, revoked_token, schema_migration, rollup, scheduler, ledger, rate_limit, idempotency, export_job
+from app.models.transaction import TransactionORM, Status
+from app.models.ledger import CardLedgerORM, MINOR_UNITS_PER_UNIT
+from app.models.rate_limit import RateLimitBucketORM
+from app.models.idempotency import IdempotencyKeyORM
+from app.models.export_job import ExportJobORM
+
+from app.models.rollup import CardDailySpendORM, MerchantDailySpendORM
+from app.models.scheduler import SchedulerLeaseORM, JobRunORM
+
+from app.services.partition_service import TransactionPartitionService
+
+from app.crud.rollup import SpendRollupCRUD
+
+
+class Migration:
+    def __init__(self, version: int, name: str, upgrade, transactional: bool = True):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+        # Non-transactional migrations run in autocommit mode, e.g. CREATE INDEX CONCURRENTLY
+        self.transactional = transactional
+
+
+async def create_index_concurrently(conn, name: str, table: str, columns: str, unique: bool = False):
+    # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would keep
+    result = await conn.execute(text("SELECT i.indisvalid FROM pg_class c "
+                                     "JOIN pg_index i ON i.indexrelid = c.oid "
+                                     "WHERE c.relname = :name"), {"name": name})
+    is_valid = result.scalar()
+    if is_valid is True:
+        return
+    if is_valid is False:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    unique_sql = "UNIQUE " if unique else ""
+    await conn.execute(text(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+async def create_partitioned_index_concurrently(conn, name: str, table: str, columns: str):
+    # CONCURRENTLY is not allowed on a partitioned table: the parent index is created ON ONLY the
+    # parent (invalid, no data), each partition's index is built concurrently and attached, and the
+    # parent index turns valid once every partition has one. New partitions inherit it.
+    is_valid = (await conn.execute(text("SELECT i.indisvalid FROM pg_class c "
+                                        "JOIN pg_index i ON i.indexrelid = c.oid "
+                                        "WHERE c.relname = :name"), {"name": name})).scalar()
+    if is_valid is True:
+        return
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({columns})"))
+
+    partitions = (await conn.execute(text("SELECT c.relname FROM pg_inherits i "
+                                          "JOIN pg_class c ON c.oid = i.inhrelid "
+                                          "WHERE i.inhparent = CAST(:table AS regclass)"), {"table": table})).scalars().all()
+    for partition in partitions:
+        partition_index = f"{partition}_{name.removeprefix(f'ix_{table}_')}"
+        await create_index_concurrently(conn, partition_index, partition, columns)
+        attached = (await conn.execute(text("SELECT 1 FROM pg_inherits "
+                                            "WHERE inhrelid = CAST(:index AS regclass)"), {"index": partition_index})).scalar()
+        if attached is None:
+            await conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}"))
+
+
+# Migration 1 creates the current model from scratch, so every later migration
+# has to be idempotent: it only changes databases created by an older release.
+async def baseline(conn):
+    await conn.run_sync(Base.metadata.create_all)
+
+
+DUPLICATE_CARDS = ("SELECT id, keep_id FROM "
+                   "(SELECT id, min(id) OVER (PARTITION BY number, carrier_id) AS keep_id FROM cards) ranked "
+                   "WHERE id <> keep_id")
+
+
+async def merge_duplicate_cards():
+    # A unique index cannot be built over duplicates. Each (number, carrier_id) keeps its oldest card,
+    # which takes over the transactions of the others, all in one transaction.
+    async with async_engine.begin() as conn:
+        duplicates = (await conn.execute(text(DUPLICATE_CARDS))).all()
+        if not duplicates:
+            return
+        for duplicate in duplicates:
+            print(f"Merging duplicate card {duplicate.id} into card {duplicate.keep_id}")
+        await conn.execute(text(f"UPDATE transactions SET card_id = duplicates.keep_id "
+                                f"FROM ({DUPLICATE_CARDS}) duplicates WHERE transactions.card_id = duplicates.id"))
+        await conn.execute(text(f"DELETE FROM cards WHERE id IN (SELECT id FROM ({DUPLICATE_CARDS}) duplicates)"))
+
+
+async def hot_path_indexes(conn):
+    await create_index_concurrently(conn, "ix_cards_carrier_id", "cards", "carrier_id")
+    await create_index_concurrently(conn, "ix_cards_expires_date_frozen", "cards", "expires_date, frozen")
+    await merge_duplicate_cards()
+    await create_index_concurrently(conn, "uq_cards_number_carrier_id", "cards", "number, carrier_id", unique=True)
+    await create_index_concurrently(conn, "ix_transactions_card_id", "transactions", "card_id")
+    await create_index_concurrently(conn, "ix_transactions_transaction_date", "transactions", "transaction_date")
+
+
+# Rows copied per commit by partition_transactions
+COPY_BATCH_SIZE = 10000
+
+
+async def partition_transactions(conn):
+    # Runs outside a transaction: the copy commits batch by batch and resumes where it stopped after a crash.
+    # Workers that start meanwhile wait on the migration lock instead of serving a half-copied table.
+    last_month = TransactionPartitionService.last_partition_month()
+    relkind = (await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'transactions'"))).scalar()
+    if relkind == "r":
+        async with async_engine.begin() as setup:
+            await setup.execute(text("ALTER TABLE transactions RENAME TO transactions_unpartitioned"))
+            await setup.execute(text("ALTER TABLE transactions_unpartitioned "
+                                     "RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey"))
+            await setup.execute(text("DROP INDEX IF EXISTS ix_transactions_card_id, ix_transactions_transaction_date"))
+            await setup.run_sync(TransactionORM.__table__.create)
+            # New payments get ids above every row still to be copied
+            await setup.execute(text("SELECT setval(pg_get_serial_sequence('transactions', 'id'), "
+                                     "coalesce((SELECT max(id) FROM transactions_unpartitioned), 0) + 1, false)"))
+
+    if await conn.scalar(text("SELECT to_regclass('transactions_unpartitioned')")) is None:
+        await TransactionPartitionService.ensure_partitions(conn, date.today(), last_month)
+        return
+
+    first_day = (await conn.execute(text("SELECT min(transaction_date) FROM transactions_unpartitioned"))).scalar()
+    await TransactionPartitionService.ensure_partitions(conn, first_day or date.today(), last_month)
+
+    after_id = (await conn.execute(text("SELECT coalesce(max(id), 0) FROM transactions "
+                                        "WHERE id <= (SELECT max(id) FROM transactions_unpartitioned)"))).scalar()
+    while True:
+        after_id = (await conn.execute(text(
+            "WITH copied AS (INSERT INTO transactions "
+            "(id, amount_of_money, name, transaction_date, transaction_time, status, card_id) "
+            "SELECT id, amount_of_money, name, transaction_date, transaction_time, status, card_id "
+            "FROM transactions_unpartitioned "
+            "WHERE id > :after_id AND transaction_date IS NOT NULL ORDER BY id LIMIT :batch_size "
+            "RETURNING id) SELECT max(id) FROM copied"),
+            {"after_id": after_id, "batch_size": COPY_BATCH_SIZE})).scalar()
+        if after_id is None:
+            break
+
+    # The partition key cannot be NULL, and inventing a date would rewrite history, so those rows are set aside
+    null_dates = (await conn.execute(text("SELECT count(*) FROM transactions_unpartitioned "
+                                          "WHERE transaction_date IS NULL"))).scalar()
+    if null_dates:
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS transactions_without_date AS "
+                                "SELECT * FROM transactions_unpartitioned WHERE transaction_date IS NULL"))
+        print(f"{null_dates} transactions without a transaction_date were not partitioned, "
+              f"they are kept in transactions_without_date")
+    await conn.execute(text("DROP TABLE transactions_unpartitioned"))
+
+
+async def spend_rollups(conn):
+    await conn.run_sync(CardDailySpendORM.__table__.create, checkfirst=True)
+    await conn.run_sync(MerchantDailySpendORM.__table__.create, checkfirst=True)
+    await conn.execute(text("TRUNCATE card_daily_spend, merchant_daily_spend"))
+    source = SpendRollupCRUD.transactions_source(date.min)
+    for stmt in SpendRollupCRUD.upsert_statements(source):
+        await conn.execute(stmt)
+
+
+async def user_security_version(conn):
+    await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS security_version integer NOT NULL DEFAULT 0"))
+    await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS security_changed_at timestamptz"))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_security_changed_at ON users (security_changed_at)"))
+
+
+async def scheduler_leader_election(conn):
+    await conn.run_sync(SchedulerLeaseORM.__table__.create, checkfirst=True)
+    await conn.run_sync(JobRunORM.__table__.create, checkfirst=True)
+
+
+async def card_ledger(conn):
+    await conn.execute(text("ALTER TABLE cards ADD COLUMN IF NOT EXISTS balance_minor bigint NOT NULL DEFAULT 0"))
+    await conn.execute(text("ALTER TABLE cards ADD COLUMN IF NOT EXISTS spend_limit_minor bigint"))
+    await conn.run_sync(CardLedgerORM.__table__.create, checkfirst=True)
+
+    # Approved transactions still in the table become one opening posting per card
+    opening = func.round(func.sum(TransactionORM.amount_of_money) * MINOR_UNITS_PER_UNIT).cast(BigInteger)
+    opening_balances = (select(TransactionORM.card_id, opening, opening)
+                        .where(TransactionORM.status == Status.approved,
+                               ~exists().where(CardLedgerORM.card_id == TransactionORM.card_id))
+                        .group_by(TransactionORM.card_id))
+    await conn.execute(CardLedgerORM.__table__.insert().from_select(
+        ["card_id", "amount_minor", "balance_after_minor"], opening_balances))
+    await conn.execute(text("UPDATE cards SET balance_minor = coalesce("
+                            "(SELECT sum(amount_minor) FROM card_ledger WHERE card_ledger.card_id = cards.id), 0)"))
+
+
+async def rate_limit_buckets(conn):
+    await conn.run_sync(RateLimitBucketORM.__table__.create, checkfirst=True)
+
+
+async def idempotency_keys(conn):
+    await conn.run_sync(IdempotencyKeyORM.__table__.create, checkfirst=True)
+
+
+async def transaction_search_indexes(conn):
+    await create_partitioned_index_concurrently(conn, "ix_transactions_date_id", "transactions",
+                                                "transaction_date, id")
+    await create_partitioned_index_concurrently(conn, "ix_transactions_card_id_date_id", "transactions",
+                                                "card_id, transaction_date, id")
+    await create_partitioned_index_concurrently(conn, "ix_transactions_card_id_amount_id", "transactions",
+                                                "card_id, amount_of_money, id")
+    await create_partitioned_index_concurrently(conn, "ix_transactions_name_pattern", "transactions",
+                                                "name text_pattern_ops")
+
+
+async def export_jobs(conn):
+    await conn.run_sync(ExportJobORM.__table__.create, checkfirst=True)
+
+
+MIGRATIONS = [
+    Migration(1, "baseline", baseline),
+    Migration(2, "hot_path_indexes", hot_path_indexes, transactional=False),
+    Migration(3, "partition_transactions", partition_transactions, transactional=False),
+    Migration(4, "spend_rollups", spend_rollups),
+    Migration(5, "user_security_version", user_security_version),
+    Migration(6, "scheduler_leader_election", scheduler_leader_election),
+    Migration(7, "card_ledger", card_ledger),
+    Migration(8, "rate_limit_buckets", rate_limit_buckets),
+    Migration(9, "idempotency_keys", idempotency_keys),
+    Migration(10, "transaction_search_indexes", transaction_search_indexes, transactional=False),
+    Migration(11, "export_jobs", export_jobs),
+]
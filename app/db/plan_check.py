@@ -0,0 +1,76 @@
+import asyncio
+import json
+import sys
+
+from datetime import date, timedelta
+
+from sqlalchemy import select, exists, text
+from sqlalchemy.dialects import postgresql
+
+from app.db.database import async_engine
+
+from app.models.card import CardORM
+from app.models.transaction import TransactionORM, Transaction_search, Transaction_sort
+
+from app.crud.transaction import TransactionCRUD
+
+
+INDEX_NODE_TYPES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def hot_queries():
+    month_ago = date.today() - timedelta(days=30)
+    return {
+        "CardCRUD.get_all_cards": select(CardORM).where(CardORM.carrier_id == 1),
+        "Card.check_if_card_exists": select(exists().where(CardORM.number == "4000000000000002",
+                                                           CardORM.carrier_id == 1)),
+        "TransactionCRUD.get_all_transactions_by_card_id": select(TransactionORM).where(TransactionORM.card_id == 1),
+        "TransactionCRUD.search_transactions (card, largest)": TransactionCRUD._search_stmt(
+            Transaction_search(card_id=1, sort=Transaction_sort.largest), None, 100),
+        "TransactionCRUD.search_transactions (merchant prefix)": TransactionCRUD._search_stmt(
+            Transaction_search(merchant="Shop"), None, 100),
+        "CardCleanupService.freeze_expired_cards": select(CardORM.id).where(CardORM.expires_date < date.today(),
+                                                                            CardORM.frozen == False),
+        "CardCleanupService.delete_all_old_frozen_cards": select(CardORM.id).where(CardORM.expires_date < month_ago,
+                                                                                   CardORM.frozen == True),
+        "CardCleanupService.delete_all_old_transactions": select(TransactionORM.id).where(
+            TransactionORM.transaction_date < month_ago),
+    }
+
+
+def plan_node_types(plan: dict):
+    yield plan["Node Type"]
+    for child in plan.get("Plans", []):
+        yield from plan_node_types(child)
+
+
+async def check_query_plans():
+    failures = {}
+    async with async_engine.connect() as conn:
+        # Small test tables are always cheaper to scan sequentially, so ask the
+        # planner whether an index path exists at all
+        await conn.execute(text("SET enable_seqscan = off"))
+        for name, stmt in hot_queries().items():
+            sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            node_types = set(plan_node_types(plan[0]["Plan"]))
+            if not node_types & INDEX_NODE_TYPES:
+                failures[name] = sorted(node_types)
+    return failures
+
+
+async def main():
+    failures = await check_query_plans()
+    await async_engine.dispose()
+    for name, node_types in failures.items():
+        print(f"{name}: no index scan in plan {node_types}")
+    if failures:
+        sys.exit(1)
+    print("All hot queries use index scans")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
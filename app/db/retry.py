@@ -0,0 +1,38 @@
+import asyncio
+import random
+
+from sqlalchemy import exc
+
+from app.core.config import settings
+from app.core.metrics import metrics_registry
+
+
+# serialization_failure and deadlock_detected: the whole transaction can simply be run again
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+db_retries_total = metrics_registry.counter(
+    "db_retries_total", "Transactions re-run after a serialization failure or deadlock", ("sqlstate",))
+
+
+def retryable_sqlstate(error: Exception):
+    if isinstance(error, exc.DBAPIError):
+        sqlstate = getattr(error.orig, "sqlstate", None)
+        if sqlstate in RETRYABLE_SQLSTATES:
+            return sqlstate
+    return None
+
+
+async def run_with_retry(operation, attempts: int = None, base_delay_ms: float = None):
+    # operation has to open its own session: a failed transaction cannot be reused
+    attempts = attempts or settings.DB_RETRY_ATTEMPTS
+    base_delay_ms = settings.DB_RETRY_BASE_DELAY_MS if base_delay_ms is None else base_delay_ms
+    for attempt in range(1, attempts + 1):
+        try:
+            return await operation()
+        except exc.DBAPIError as e:
+            sqlstate = retryable_sqlstate(e)
+            if sqlstate is None or attempt == attempts:
+                raise
+            db_retries_total.inc(sqlstate)
+            # Full jitter keeps the losers of a lock conflict from colliding again in lockstep
+            await asyncio.sleep(random.uniform(0, base_delay_ms * 2 ** (attempt - 1)) / 1000)
@@ -1,9 +1,9 @@
 import enum
 
 from datetime import date
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter
 
-from sqlalchemy import ForeignKey, String
+from sqlalchemy import BigInteger, ForeignKey, Index, String
 from sqlalchemy import select, exists
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -26,6 +26,15 @@ class CardORM(Base):
     cvv : Mapped[str] = mapped_column(String(3), nullable=False)
     carrier_id : Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE", onupdate="CASCADE"))
     frozen : Mapped[bool] = mapped_column(nullable=False, default=False)
+    # Running total of the card's ledger postings and the cap it may not exceed, in minor units
+    balance_minor : Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    spend_limit_minor : Mapped[int | None] = mapped_column(BigInteger)
+
+    __table_args__ = (
+        Index("ix_cards_carrier_id", "carrier_id"),
+        Index("ix_cards_expires_date_frozen", "expires_date", "frozen"),
+        Index("uq_cards_number_carrier_id", "number", "carrier_id", unique=True),
+    )
 
 
 
@@ -36,6 +45,8 @@ class Card(BaseModel):
     expires_date : date = None
     payment_system : Payment_system = None
     frozen : bool = False
+    balance_minor : int = 0
+    spend_limit_minor : int | None = None
 
     carrier_id: int = None
 
@@ -58,8 +69,29 @@ class Card(BaseModel):
     class Config:
         from_attributes = True
 
+# Listings select only these columns and validate the rows in one pass
+CARD_COLUMNS = (CardORM.id, CardORM.number, CardORM.carrier_name, CardORM.expires_date,
+                CardORM.payment_system, CardORM.frozen, CardORM.balance_minor, CardORM.spend_limit_minor,
+                CardORM.carrier_id)
+cards_adapter = TypeAdapter(list[Card])
+
 class Card_In_DB(Card):
     cvv : str
 
 
-Card_check_functions = Card()
\ No newline at end of file
+Card_check_functions = Card()
+
+
+class Card_import_row(BaseModel):
+    number : str = Field(min_length=16, max_length=16, pattern=r"^[0-9]{16}$")
+    carrier_name : str
+    expires_date : date
+    payment_system : Payment_system
+    cvv : str = Field(min_length=3, max_length=3)
+
+
+class Card_import_result(BaseModel):
+    row : int
+    accepted : bool
+    card_id : int | None = None
+    detail : str | None = None
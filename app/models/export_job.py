@@ -0,0 +1,81 @@
+import enum
+
+from datetime import datetime
+
+from pydantic import BaseModel, computed_field
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, String, Text, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.database import Base
+
+
+class Export_kind(enum.Enum):
+    transactions = "transactions"
+    cards = "cards"
+
+class Export_format(enum.Enum):
+    csv = "csv"
+    parquet = "parquet"
+
+class Export_status(enum.Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class ExportJobORM(Base):
+    __tablename__ = "export_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[Export_kind] = mapped_column(nullable=False)
+    format: Mapped[Export_format] = mapped_column(nullable=False)
+    status: Mapped[Export_status] = mapped_column(nullable=False, default=Export_status.queued)
+    requested_by: Mapped[int | None] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
+    # The worker that owns the job refreshes heartbeat_at; a job whose heartbeat stops was abandoned
+    node: Mapped[str | None] = mapped_column(String(255))
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # rows_total is the planner's estimate, taken when the job starts
+    rows_written: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    rows_total: Mapped[int | None] = mapped_column(BigInteger)
+    file_name: Mapped[str | None] = mapped_column(String(255))
+    size_bytes: Mapped[int | None] = mapped_column(BigInteger)
+    error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_export_jobs_status_finished_at", "status", "finished_at"),
+        Index("ix_export_jobs_status_heartbeat_at", "status", "heartbeat_at"),
+    )
+
+
+class Export_job(BaseModel):
+    id: int
+    kind: Export_kind
+    format: Export_format
+    status: Export_status
+    requested_by: int | None = None
+    node: str | None = None
+    heartbeat_at: datetime | None = None
+    rows_written: int = 0
+    rows_total: int | None = None
+    file_name: str | None = None
+    size_bytes: int | None = None
+    error: str | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+    @computed_field
+    @property
+    def progress(self) -> float | None:
+        if self.status == Export_status.succeeded:
+            return 1.0
+        if not self.rows_total:
+            return None
+        return min(self.rows_written / self.rows_total, 0.99)
+
+    class Config:
+        from_attributes = True
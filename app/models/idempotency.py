@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, String, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.database import Base
+
+
+class IdempotencyKeyORM(Base):
+    __tablename__ = "idempotency_keys"
+
+    # "<user id>:<Idempotency-Key header>", so two users can never see each other's responses
+    key: Mapped[str] = mapped_column(String(300), primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    # Both stay NULL while the first request is still being processed
+    status_code: Mapped[int | None] = mapped_column()
+    body: Mapped[dict | None] = mapped_column(JSONB)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
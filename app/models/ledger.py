@@ -0,0 +1,34 @@
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.database import Base
+
+
+# Balances, limits and postings are kept in cents so sums never pick up float error
+MINOR_UNITS_PER_UNIT = 100
+# Largest accepted amount or limit; its minor units, and balances summed from many of them, stay far inside BIGINT
+MAX_AMOUNT = 10 ** 9
+
+
+def to_minor_units(amount: float) -> int:
+    return int((Decimal(str(amount)) * MINOR_UNITS_PER_UNIT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class CardLedgerORM(Base):
+    # Append-only: every approved payment adds one posting and moves cards.balance_minor by the same amount
+    __tablename__ = "card_ledger"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    card_id: Mapped[int] = mapped_column(ForeignKey("cards.id", ondelete="CASCADE"), nullable=False)
+    # No foreign key: transactions are partitioned and expire long before the postings do
+    transaction_id: Mapped[int | None] = mapped_column()
+    amount_minor: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    balance_after_minor: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_card_ledger_card_id_id", "card_id", "id"),
+    )
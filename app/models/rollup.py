@@ -0,0 +1,55 @@
+import enum
+
+from datetime import date
+
+from pydantic import BaseModel
+
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.database import Base
+
+from app.models.transaction import Status
+
+
+class CardDailySpendORM(Base):
+    __tablename__ = "card_daily_spend"
+
+    card_id: Mapped[int] = mapped_column(ForeignKey("cards.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
+    status: Mapped[Status] = mapped_column(primary_key=True)
+    total_amount: Mapped[float] = mapped_column(nullable=False, default=0)
+    transaction_count: Mapped[int] = mapped_column(nullable=False, default=0)
+    min_amount: Mapped[float] = mapped_column(nullable=False)
+    max_amount: Mapped[float] = mapped_column(nullable=False)
+
+
+class MerchantDailySpendORM(Base):
+    __tablename__ = "merchant_daily_spend"
+
+    carrier_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    merchant: Mapped[str] = mapped_column(primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
+    total_amount: Mapped[float] = mapped_column(nullable=False, default=0)
+    transaction_count: Mapped[int] = mapped_column(nullable=False, default=0)
+
+
+class Spend_period_unit(enum.Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+
+
+class Spend_period(BaseModel):
+    period_start: date
+    status: Status
+    total_amount: float
+    transaction_count: int
+    min_amount: float
+    max_amount: float
+
+
+class Merchant_spend(BaseModel):
+    merchant: str
+    total_amount: float
+    transaction_count: int
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+from sqlalchemy import DateTime, Index, String, Text, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.database import Base
+
+
+class SchedulerLeaseORM(Base):
+    __tablename__ = "scheduler_leases"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    holder: Mapped[str] = mapped_column(String(255), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class JobRunORM(Base):
+    __tablename__ = "scheduler_job_runs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    job_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    node: Mapped[str] = mapped_column(String(255), nullable=False)
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    duration_seconds: Mapped[float] = mapped_column(nullable=False)
+    rows_affected: Mapped[int | None] = mapped_column()
+    succeeded: Mapped[bool] = mapped_column(nullable=False)
+    error: Mapped[str | None] = mapped_column(Text)
+
+    __table_args__ = (
+        Index("ix_scheduler_job_runs_job_id_started_at", "job_id", "started_at"),
+    )
+
+
+class Job_run(BaseModel):
+    id: int
+    job_id: str
+    node: str
+    started_at: datetime
+    duration_seconds: float
+    rows_affected: int | None = None
+    succeeded: bool
+    error: str | None = None
+
+    class Config:
+        from_attributes = True
@@ -1,12 +1,14 @@
 import enum
 
-from pydantic import BaseModel
-from datetime import date, time
+from pydantic import BaseModel, BeforeValidator, Field, TypeAdapter
+from datetime import date, datetime, time
+from typing import Annotated
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db.database import Base
+from app.models.ledger import MAX_AMOUNT
 
 class Status(enum.Enum):
     approved = "APPROVED"
@@ -17,17 +19,31 @@ class Status(enum.Enum):
 class TransactionORM(Base):
 
     __tablename__ = "transactions"
-    id: Mapped[int] = mapped_column(primary_key=True)
+    # The partition key has to be part of the primary key
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     amount_of_money: Mapped[float] = mapped_column(nullable=False)
     name: Mapped[str] = mapped_column(nullable=True)
-    transaction_date: Mapped[date] = mapped_column(nullable=True)
+    transaction_date: Mapped[date] = mapped_column(primary_key=True)
     transaction_time: Mapped[time] = mapped_column(nullable=True)
     status: Mapped[Status] = mapped_column(nullable=True)
 
     card_id: Mapped[str] = mapped_column(ForeignKey("cards.id", ondelete="CASCADE"))
 
+    __table_args__ = (
+        Index("ix_transactions_card_id", "card_id"),
+        Index("ix_transactions_transaction_date", "transaction_date"),
+        # Keyset order of the search endpoint, globally and per card
+        Index("ix_transactions_date_id", "transaction_date", "id"),
+        Index("ix_transactions_card_id_date_id", "card_id", "transaction_date", "id"),
+        Index("ix_transactions_card_id_amount_id", "card_id", "amount_of_money", "id"),
+        # LIKE 'prefix%' can only use a btree index built with pattern ops
+        Index("ix_transactions_name_pattern", "name", postgresql_ops={"name": "text_pattern_ops"}),
+        {"postgresql_partition_by": "RANGE (transaction_date)"},
+    )
+
 
 class Transaction(BaseModel):
+    id: int | None = None
     amount_of_money: float
     name: str
     transaction_date: date
@@ -39,3 +55,65 @@ class Transaction(BaseModel):
     class Config:
         from_attributes = True
 
+
+TRANSACTION_COLUMNS = (TransactionORM.id, TransactionORM.amount_of_money, TransactionORM.name,
+                       TransactionORM.transaction_date, TransactionORM.transaction_time,
+                       TransactionORM.status, TransactionORM.card_id)
+transactions_adapter = TypeAdapter(list[Transaction])
+
+
+class Transaction_sort(enum.Enum):
+    newest = "newest"
+    oldest = "oldest"
+    largest = "largest"
+    smallest = "smallest"
+
+
+def parse_date_bound(value):
+    # Decided by the format: left to the date | datetime union, pydantic reads a midnight timestamp
+    # or an epoch number as a plain date. A 10-character ISO date covers the whole day
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value) if len(value) == 10 else datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    raise ValueError("Expected an ISO date or date and time")
+
+Date_bound = Annotated[date | datetime, BeforeValidator(parse_date_bound)]
+
+
+class Transaction_search(BaseModel):
+    # A plain date covers the whole day, a date and time is an exact bound
+    date_from: Date_bound | None = None
+    date_to: Date_bound | None = None
+    amount_min: float | None = None
+    amount_max: float | None = None
+    status: Status | None = None
+    merchant: str | None = None
+    card_id: int | None = None
+    user_id: int | None = None
+    sort: Transaction_sort = Transaction_sort.newest
+
+
+class Payment_outcome(enum.Enum):
+    approved = "approved"
+    card_not_found = "card_not_found"
+    card_frozen = "card_frozen"
+    limit_exceeded = "limit_exceeded"
+    card_expired = "card_expired"
+
+
+class Payment(BaseModel):
+    card_id: int
+    money_amount: float = Field(gt=0, le=MAX_AMOUNT, allow_inf_nan=False)
+    company_name: str = "Free payment"
+
+
+class Payment_result(BaseModel):
+    index: int
+    card_id: int
+    accepted: bool
+    transaction_id: int | None = None
+    detail: str | None = None
@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from datetime import datetime
 
-from sqlalchemy import select, exists
+from pydantic import BaseModel, TypeAdapter
+
+from sqlalchemy import select, exists, DateTime
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db.database import Base
@@ -23,6 +25,10 @@ class UserORM(Base):
 
     role : Mapped[str] = mapped_column(nullable=False, default="user")
 
+    # Bumped on role, activity, password and login changes so stateless tokens issued before it are rejected
+    security_version : Mapped[int] = mapped_column(nullable=False, default=0, server_default="0")
+    security_changed_at : Mapped[datetime | None] = mapped_column(DateTime(timezone=True), index=True)
+
 class User(BaseModel):
     id: int | None = None
     username: str = None
@@ -53,9 +59,14 @@ class User(BaseModel):
     class Config:
         from_attributes = True
 
+USER_COLUMNS = (UserORM.id, UserORM.username, UserORM.email, UserORM.name, UserORM.surname, UserORM.patronymic,
+                UserORM.phone_number, UserORM.address, UserORM.disabled, UserORM.role)
+users_adapter = TypeAdapter(list[User])
+
 
 user_operations = User()
 
 
 class User_In_DB(User):
-    hashed_password: str
\ No newline at end of file
+    hashed_password: str
+    security_version: int = 0
\ No newline at end of file
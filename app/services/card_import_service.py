@@ -0,0 +1,65 @@
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+
+from app.services.validate_service import ValidationService
+
+from app.models.card import Card_import_row, Card_import_result
+
+from app.crud.card import Card_CRUD
+
+
+class CardImportService:
+    FORMATS = ("csv", "ndjson")
+
+    @staticmethod
+    def read_records(content: bytes, file_format: str):
+        text = content.decode("utf-8-sig")
+        if file_format == "csv":
+            return list(csv.DictReader(io.StringIO(text)))
+        return [line for line in text.splitlines() if line.strip()]
+
+    @staticmethod
+    def parse_record(record, file_format: str):
+        if file_format == "csv":
+            return Card_import_row.model_validate(record)
+        return Card_import_row.model_validate(json.loads(record))
+
+    @staticmethod
+    async def import_cards(records: list, file_format: str, carrier_id: int):
+        results = []
+        parsed = []
+        for index, record in enumerate(records):
+            result = Card_import_result(row=index, accepted=False)
+            results.append(result)
+            try:
+                parsed.append((result, CardImportService.parse_record(record, file_format)))
+            except ValidationError as e:
+                result.detail = e.errors(include_url=False)[0]["msg"]
+            except ValueError as e:
+                result.detail = f"Cannot parse this row: {e}"
+
+        luhn_valid = ValidationService.validate_card_numbers_by_luna_algorithm([card.number for _, card in parsed])
+        candidates = []
+        seen_numbers = set()
+        for (result, card), is_valid in zip(parsed, luhn_valid):
+            if not is_valid:
+                result.detail = "A card with this number cannot exist"
+            elif card.number in seen_numbers:
+                result.detail = "Duplicate card number in this file"
+            else:
+                seen_numbers.add(card.number)
+                candidates.append((result, card))
+
+        existing_numbers, card_ids = await Card_CRUD.add_cards_bulk([card for _, card in candidates], carrier_id)
+        for result, card in candidates:
+            if card.number in card_ids:
+                result.accepted = True
+                result.card_id = card_ids[card.number]
+            elif card.number in existing_numbers:
+                result.detail = "Card already exists"
+            else:
+                result.detail = "Card was added concurrently by another request"
+        return results
@@ -1,75 +1,94 @@
+import time
+
 from datetime import date, timedelta
 
-from sqlalchemy import select
+from sqlalchemy import select, update, delete, func
+
+from app.core.config import settings
+from app.core.metrics import instrument_queries, cleanup_step_duration_seconds, cleanup_rows_affected_total
 
 from app.db.database import async_session_factory
 
 from app.models.card import CardORM
 from app.models.transaction import TransactionORM
 
+from app.services.partition_service import TransactionPartitionService
+
 
+@instrument_queries
 class CardCleanupService:
     @staticmethod
-    async def freeze_expired_cards():
-        async with async_session_factory() as session:
-            today = date.today()
-            stmt = select(CardORM).where(CardORM.expires_date < today, CardORM.frozen == False)
-            result = await session.execute(stmt)
-            expires_cards = result.scalars().all()
-
-            frozen_counter = 0
-
-            if expires_cards:
-                for card in expires_cards:
-                    card.frozen = True
-                    frozen_counter += 1
-
-                if frozen_counter > 0:
-                    await session.commit()
+    async def _run_in_batches(model, conditions: list, build_statement, dry_run: bool = False):
+        if dry_run:
+            async with async_session_factory() as session:
+                stmt = select(func.count()).select_from(model).where(*conditions)
+                return {"rows": await session.scalar(stmt), "batches": [], "dry_run": True}
+
+        batch_size = settings.CLEANUP_BATCH_SIZE
+        report = {"rows": 0, "batches": [], "dry_run": False}
+        while True:
+            started = time.perf_counter()
+            async with async_session_factory() as session:
+                batch_ids = select(model.id).where(*conditions).limit(batch_size).scalar_subquery()
+                stmt = build_statement(model.id.in_(batch_ids)).execution_options(synchronize_session=False)
+                result = await session.execute(stmt)
+                await session.commit()
+
+            report["rows"] += result.rowcount
+            report["batches"].append({"rows": result.rowcount,
+                                      "seconds": round(time.perf_counter() - started, 4)})
+            if result.rowcount < batch_size:
+                return report
 
 
     @staticmethod
-    async def delete_all_old_frozen_cards():
-        async with async_session_factory() as session:
-            month_ago = date.today() - timedelta(days=30)
-            stmt = select(CardORM).where(CardORM.expires_date < month_ago, CardORM.frozen == True)
-            result = await session.execute(stmt)
-            cards_to_delete = result.scalars().all()
-
-            deleted_counter = 0
-            if cards_to_delete:
-                for card in cards_to_delete:
-                    await session.delete(card)
-                    deleted_counter += 1
-
-                if deleted_counter > 0:
-                    await session.commit()
+    async def freeze_expired_cards(dry_run: bool = False):
+        today = date.today()
+        return await CardCleanupService._run_in_batches(
+            CardORM,
+            [CardORM.expires_date < today, CardORM.frozen == False],
+            lambda batch: update(CardORM).where(batch).values(frozen=True),
+            dry_run)
 
 
     @staticmethod
-    async def delete_all_old_transactions():
-        async with async_session_factory() as session:
-            month_ago = date.today() - timedelta(days=30)
-            stmt = select(TransactionORM).where(TransactionORM.transaction_date < month_ago)
-            result = await session.execute(stmt)
-            old_transactions = result.scalars().all()
-
-            deleted_counter = 0
+    async def delete_all_old_frozen_cards(dry_run: bool = False):
+        month_ago = date.today() - timedelta(days=30)
+        return await CardCleanupService._run_in_batches(
+            CardORM,
+            [CardORM.expires_date < month_ago, CardORM.frozen == True],
+            lambda batch: delete(CardORM).where(batch),
+            dry_run)
 
-            if old_transactions:
-                for transaction in old_transactions:
-                    await session.delete(transaction)
-                    deleted_counter += 1
 
-                if deleted_counter > 0:
-                    await session.commit()
+    @staticmethod
+    async def delete_all_old_transactions(dry_run: bool = False):
+        # Whole expired months are dropped as partitions, only the boundary month is deleted row by row
+        dropped_partitions = await TransactionPartitionService.drop_expired_partitions(dry_run)
+        retention_cutoff = date.today() - timedelta(days=settings.TRANSACTION_RETENTION_DAYS)
+        report = await CardCleanupService._run_in_batches(
+            TransactionORM,
+            [TransactionORM.transaction_date < retention_cutoff],
+            lambda batch: delete(TransactionORM).where(batch),
+            dry_run)
+        report["dropped_partitions"] = dropped_partitions
+        return report
 
 
     @staticmethod
-    async def perform_full_cleanup():
+    async def perform_full_cleanup(dry_run: bool = False):
         print("CLEANUP START")
-        await CardCleanupService.freeze_expired_cards()
-        await CardCleanupService.delete_all_old_frozen_cards()
-        await CardCleanupService.delete_all_old_transactions()
-        print("CLEANUP END")
-
+        steps = {
+            "freeze_expired_cards": CardCleanupService.freeze_expired_cards,
+            "delete_all_old_frozen_cards": CardCleanupService.delete_all_old_frozen_cards,
+            "delete_all_old_transactions": CardCleanupService.delete_all_old_transactions,
+        }
+        report = {}
+        for name, step in steps.items():
+            started = time.perf_counter()
+            report[name] = await step(dry_run)
+            if not dry_run:
+                cleanup_step_duration_seconds.observe(time.perf_counter() - started, name)
+                cleanup_rows_affected_total.inc(name, amount=report[name]["rows"])
+        print("CLEANUP END", {name: step["rows"] for name, step in report.items()})
+        return report
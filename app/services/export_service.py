@@ -0,0 +1,232 @@
+import asyncio
+import csv
+import enum
+import gzip
+import os
+
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import exc
+
+from app.core.config import settings
+from app.core.leader import scheduler_lease
+from app.core.metrics import metrics_registry
+
+from app.crud.card import Card_CRUD
+from app.crud.export_job import export_job_crud
+from app.crud.transaction import transaction_crud
+
+from app.models.card import CARD_COLUMNS
+from app.models.export_job import Export_job, Export_kind, Export_format
+from app.models.transaction import TRANSACTION_COLUMNS
+
+
+export_rows_written_total = metrics_registry.counter(
+    "export_rows_written_total", "Rows written to export files", ("kind", "format"))
+
+# Table to estimate, exported columns and a keyset page reader per kind; cards never export the cvv
+EXPORT_SOURCES = {
+    Export_kind.transactions: ("transactions", TRANSACTION_COLUMNS, transaction_crud.get_all_transactions),
+    Export_kind.cards: ("cards", CARD_COLUMNS, Card_CRUD.get_all_existing_cards),
+}
+
+EXPORT_FILES = {
+    Export_format.csv: (".csv.gz", "application/gzip"),
+    Export_format.parquet: (".parquet", "application/vnd.apache.parquet"),
+}
+
+
+def export_value(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+
+class CsvExportWriter:
+    # The writers block on disk and compression, so every call goes through a worker thread
+    def __init__(self, path: Path, columns):
+        self.names = [column.key for column in columns]
+        self._file = gzip.open(path, "wt", newline="", encoding="utf-8", compresslevel=6)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.names)
+
+    def write(self, items: list):
+        self._writer.writerows([export_value(getattr(item, name)) for name in self.names] for item in items)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetExportWriter:
+    # Every chunk becomes one row group, so memory stays bounded by EXPORT_CHUNK_SIZE
+    def __init__(self, path: Path, columns):
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pa = pyarrow
+        self.names = [column.key for column in columns]
+        self.schema = pyarrow.schema([(column.key, self._arrow_type(column.type.python_type)) for column in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+
+    def _arrow_type(self, python_type):
+        if issubclass(python_type, enum.Enum):
+            return self._pa.string()
+        return {bool: self._pa.bool_(),
+                int: self._pa.int64(),
+                float: self._pa.float64(),
+                str: self._pa.string(),
+                date: self._pa.date32(),
+                time: self._pa.time64("us")}[python_type]
+
+    def write(self, items: list):
+        columns = {name: [export_value(getattr(item, name)) for item in items] for name in self.names}
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+EXPORT_WRITERS = {
+    Export_format.csv: CsvExportWriter,
+    Export_format.parquet: ParquetExportWriter,
+}
+
+
+class ExportService:
+    def __init__(self, export_dir: str, chunk_size: int, max_concurrency: int, retention_hours: float,
+                 heartbeat_seconds: float):
+        self.export_dir = Path(export_dir)
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.retention_hours = retention_hours
+        self.heartbeat_seconds = heartbeat_seconds
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        self._heartbeat = None
+        self.running = 0
+
+    @staticmethod
+    def file_name(job: Export_job):
+        suffix, _ = EXPORT_FILES[job.format]
+        return f"{job.kind.value}-{job.id}{suffix}"
+
+    def file_path(self, job: Export_job):
+        return self.export_dir / job.file_name
+
+    @staticmethod
+    def media_type(job: Export_job):
+        _, media_type = EXPORT_FILES[job.format]
+        return media_type
+
+    async def enqueue(self, kind: Export_kind, format: Export_format, requested_by: int):
+        # The job runs in the background of this worker; the request only records it
+        job = await export_job_crud.add_job(kind, format, requested_by, scheduler_lease.node)
+        task = asyncio.create_task(self._run(job), name=f"export-{job.id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: Export_job):
+        started = False
+        try:
+            async with self._slots:
+                table, columns, read_page = EXPORT_SOURCES[job.kind]
+                if not await export_job_crud.start_job(job.id, await export_job_crud.estimate_rows(table)):
+                    return
+                started = True
+                self.running += 1
+                try:
+                    await self._export(job, columns, read_page)
+                finally:
+                    self.running -= 1
+        except asyncio.CancelledError:
+            # _export records its own interruption; a job still waiting for a slot is recorded here
+            if not started:
+                await asyncio.shield(export_job_crud.finish_job(job.id, 0, error="Interrupted by shutdown"))
+            raise
+
+    async def _export(self, job: Export_job, columns, read_page):
+        file_name = self.file_name(job)
+        path = self.export_dir / file_name
+        # Written under a temporary name so a download never sees a half-written file
+        part_path = path.with_name(file_name + ".part")
+        rows_written = 0
+        writer = None
+        try:
+            await asyncio.to_thread(self.export_dir.mkdir, parents=True, exist_ok=True)
+            writer = await asyncio.to_thread(EXPORT_WRITERS[job.format], part_path, columns)
+            after_id = None
+            while True:
+                # One short keyset query per chunk, so no connection or snapshot is held for the whole export
+                items = await read_page(after_id, self.chunk_size)
+                if items:
+                    await asyncio.to_thread(writer.write, items)
+                    rows_written += len(items)
+                    after_id = items[-1].id
+                    export_rows_written_total.inc(job.kind.value, job.format.value, amount=len(items))
+                    await export_job_crud.update_progress(job.id, rows_written)
+                if len(items) < self.chunk_size:
+                    break
+            await asyncio.to_thread(writer.close)
+            writer = None
+            await asyncio.to_thread(os.replace, part_path, path)
+            size_bytes = (await asyncio.to_thread(path.stat)).st_size
+        except BaseException as e:
+            if writer is not None:
+                await asyncio.to_thread(writer.close)
+            await asyncio.to_thread(part_path.unlink, missing_ok=True)
+            error = "Interrupted by shutdown" if isinstance(e, asyncio.CancelledError) else repr(e)
+            await asyncio.shield(export_job_crud.finish_job(job.id, rows_written, error=error))
+            if not isinstance(e, Exception):
+                raise
+            return
+        await export_job_crud.finish_job(job.id, rows_written, file_name, size_bytes)
+
+    async def purge_expired(self):
+        before = datetime.now(timezone.utc) - timedelta(hours=self.retention_hours)
+        file_names = await export_job_crud.delete_jobs_before(before)
+        for file_name in filter(None, file_names):
+            await asyncio.to_thread((self.export_dir / file_name).unlink, missing_ok=True)
+        return len(file_names)
+
+    async def fail_abandoned(self):
+        # Jobs of a worker that crashed or was killed stay queued or running until this marks them failed
+        before = datetime.now(timezone.utc) - timedelta(seconds=3 * self.heartbeat_seconds)
+        jobs = await export_job_crud.fail_abandoned_jobs(before)
+        for job in jobs:
+            await asyncio.to_thread((self.export_dir / (self.file_name(job) + ".part")).unlink, missing_ok=True)
+        return len(jobs)
+
+    async def _heartbeat_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            if self._tasks:
+                try:
+                    await export_job_crud.touch_jobs(scheduler_lease.node)
+                except (exc.SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+                    print(f"Could not refresh the export jobs of {scheduler_lease.node}: {e!r}")
+
+    def start(self):
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._heartbeat_forever())
+
+    async def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def stats(self):
+        return {"running": self.running,
+                "queued": len(self._tasks) - self.running,
+                "max_concurrency": self.max_concurrency,
+                "chunk_size": self.chunk_size,
+                "export_dir": str(self.export_dir)}
+
+
+export_service = ExportService(export_dir=settings.EXPORT_DIR,
+                               chunk_size=settings.EXPORT_CHUNK_SIZE,
+                               max_concurrency=settings.EXPORT_MAX_CONCURRENCY,
+                               retention_hours=settings.EXPORT_RETENTION_HOURS,
+                               heartbeat_seconds=settings.EXPORT_HEARTBEAT_SECONDS)
@@ -0,0 +1,83 @@
+import re
+
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.metrics import instrument_queries
+
+from app.db.database import async_engine
+
+
+PARTITION_NAME = re.compile(r"^transactions_(\d{4})_(\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+@instrument_queries
+class TransactionPartitionService:
+    @staticmethod
+    def partition_name(month: date) -> str:
+        return f"transactions_{month:%Y_%m}"
+
+    @staticmethod
+    async def get_partitions(conn):
+        result = await conn.execute(text("SELECT c.relname FROM pg_inherits i "
+                                         "JOIN pg_class c ON c.oid = i.inhrelid "
+                                         "JOIN pg_class p ON p.oid = i.inhparent "
+                                         "WHERE p.relname = 'transactions'"))
+        partitions = {}
+        for name in result.scalars().all():
+            match = PARTITION_NAME.match(name)
+            if match:
+                partitions[date(int(match[1]), int(match[2]), 1)] = name
+        return partitions
+
+    @staticmethod
+    async def ensure_partitions(conn, first_month: date, last_month: date):
+        existing = await TransactionPartitionService.get_partitions(conn)
+        created = []
+        month = month_start(first_month)
+        while month <= last_month:
+            if month not in existing:
+                name = TransactionPartitionService.partition_name(month)
+                await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF transactions "
+                                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"))
+                created.append(name)
+            month = next_month(month)
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS transactions_default PARTITION OF transactions DEFAULT"))
+        return created
+
+    @staticmethod
+    def last_partition_month() -> date:
+        last_month = month_start(date.today())
+        for _ in range(settings.TRANSACTION_PARTITIONS_AHEAD):
+            last_month = next_month(last_month)
+        return last_month
+
+    @staticmethod
+    async def create_future_partitions():
+        async with async_engine.begin() as conn:
+            return await TransactionPartitionService.ensure_partitions(
+                conn, date.today(), TransactionPartitionService.last_partition_month())
+
+    @staticmethod
+    async def drop_expired_partitions(dry_run: bool = False):
+        # Only whole months that ended before the retention cutoff are dropped;
+        # the month the cutoff falls into is left to row-level cleanup
+        cutoff = date.today() - timedelta(days=settings.TRANSACTION_RETENTION_DAYS)
+        async with async_engine.begin() as conn:
+            partitions = await TransactionPartitionService.get_partitions(conn)
+            expired = [name for month, name in sorted(partitions.items()) if next_month(month) <= cutoff]
+            if not dry_run:
+                for name in expired:
+                    await conn.execute(text(f"ALTER TABLE transactions DETACH PARTITION {name}"))
+                    await conn.execute(text(f"DROP TABLE {name}"))
+        return expired
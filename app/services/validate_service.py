@@ -1,8 +1,18 @@
 import re
 
+import numpy as np
+
 from fastapi import HTTPException
 
 
+CARD_NUMBER = re.compile(r"[0-9]{16}")
+
+
+def is_card_number(number: str):
+    # str.isdigit and \d also accept non-ASCII digits such as "٤"
+    return CARD_NUMBER.fullmatch(number) is not None
+
+
 class ValidationService:
 
     @staticmethod
@@ -19,6 +29,8 @@ class ValidationService:
 
     @staticmethod
     async def validate_card_by_luna_algorithm(card_number : str):
+        if not is_card_number(card_number):
+            return False
         card_to_check = list(card_number)
         card_to_check.reverse()
         odd = 0
@@ -37,4 +49,18 @@ class ValidationService:
         else:
             return False
 
+    @staticmethod
+    def validate_card_numbers_by_luna_algorithm(card_numbers: list[str]):
+        # One vectorized Luhn pass over a (rows x 16) digit matrix; anything but 16 ASCII digits fails
+        if not card_numbers:
+            return np.zeros(0, dtype=bool)
+        well_formed = np.array([is_card_number(number) for number in card_numbers])
+        numbers = (number if ok else "0" * 16 for number, ok in zip(card_numbers, well_formed))
+        raw = np.frombuffer("".join(numbers).encode("ascii"), dtype=np.uint8)
+        digits = raw.reshape(len(card_numbers), 16).astype(np.int16) - ord("0")
+        doubled = digits[:, -2::-2] * 2
+        doubled = np.where(doubled > 9, doubled - 9, doubled)
+        checksum = digits[:, -1::-2].sum(axis=1) + doubled.sum(axis=1)
+        return well_formed & (checksum % 10 == 0)
+
 validate_service_obj = ValidationService()
\ No newline at end of file
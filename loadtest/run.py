@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+from contextlib import asynccontextmanager
+
+import httpx
+
+from loadtest.seed import PASSWORD, user_email
+
+
+ADMIN_EMAIL = "admin"
+ADMIN_PASSWORD = "adminqwerty"
+
+# Relative weight of every step in the mixed workload
+SCENARIO_WEIGHTS = {
+    "login": 5,
+    "list_cards": 30,
+    "pay": 30,
+    "list_transactions": 25,
+    "admin_list_transactions": 5,
+    "admin_list_cards": 5,
+}
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self, elapsed: float):
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values.sort()
+            endpoints[endpoint] = {"requests": len(values),
+                                   "errors": self.errors.get(endpoint, 0),
+                                   "throughput_rps": round(len(values) / elapsed, 2),
+                                   "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                                   "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                                   "p99_ms": round(percentile(values, 0.99) * 1000, 2)}
+        total = sum(len(values) for values in self.latencies.values())
+        return {"elapsed_seconds": round(elapsed, 3),
+                "requests": total,
+                "errors": sum(self.errors.values()),
+                "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+                "endpoints": endpoints}
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, email: str, password: str, rng: random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.email = email
+        self.password = password
+        self.rng = rng
+        self.token = None
+        self.card_ids = []
+
+    async def call(self, endpoint: str, method: str, url: str, **kwargs):
+        if self.token:
+            kwargs.setdefault("headers", {})["Authorization"] = f"Bearer {self.token}"
+        started = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.recorder.record(endpoint, time.perf_counter() - started, response.status_code < 400)
+        return response
+
+    async def login(self):
+        self.token = None
+        response = await self.call("login", "POST", "/authentication/token",
+                                   data={"username": self.email, "password": self.password})
+        if response.status_code == 200:
+            self.token = response.json()["access_token"]
+
+    async def list_cards(self):
+        response = await self.call("list_cards", "GET", "/Cards/Cards")
+        if response.status_code == 200:
+            self.card_ids = [card["id"] for card in response.json()]
+
+    async def pay(self):
+        if not self.card_ids:
+            return await self.list_cards()
+        await self.call("pay", "POST", "/Transaction/Transaction",
+                        params={"card_id": self.rng.choice(self.card_ids),
+                                "money_amount": round(self.rng.uniform(1, 200), 2),
+                                "company_name": f"Merchant {self.rng.randint(1, 50)}"})
+
+    async def list_transactions(self):
+        if not self.card_ids:
+            return await self.list_cards()
+        await self.call("list_transactions", "GET", "/Transaction/Transactions",
+                        params={"card_id": self.rng.choice(self.card_ids)})
+
+    async def admin_list_transactions(self):
+        await self.call("admin_list_transactions", "GET", "/Transaction/Transactions/Show_all", params={"limit": 100})
+
+    async def admin_list_cards(self):
+        await self.call("admin_list_cards", "GET", "/Cards/Cards/Show_all", params={"limit": 100})
+
+
+async def drive(user: VirtualUser, steps: list, weights: list, deadline: float):
+    await user.login()
+    while time.perf_counter() < deadline:
+        step = user.rng.choices(steps, weights)[0]
+        await getattr(user, step)()
+
+
+@asynccontextmanager
+async def make_client(base_url: str | None, rate_limits: bool):
+    if base_url:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            yield client
+        return
+
+    from main import app
+    from app.core.rate_limit import rate_limiter
+
+    # Every virtual user connects from the same address, so the per-IP buckets would
+    # turn most logins and payments into 429s and the percentiles would measure the limiter
+    rate_limiter.enabled = rate_limits
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+            yield client
+
+
+async def run(users: int, seeded_users: int, duration: float, base_url: str | None, random_seed: int,
+              rate_limits: bool = False):
+    recorder = Recorder()
+    async with make_client(base_url, rate_limits) as client:
+        admin_rng = random.Random(random_seed)
+        virtual_users = [VirtualUser(client, recorder, ADMIN_EMAIL, ADMIN_PASSWORD, admin_rng)]
+        for index in range(users - 1):
+            virtual_users.append(VirtualUser(client, recorder, user_email(index % seeded_users), PASSWORD,
+                                             random.Random(random_seed + index + 1)))
+
+        admin_steps = [step for step in SCENARIO_WEIGHTS if step.startswith("admin_")]
+        user_steps = [step for step in SCENARIO_WEIGHTS if not step.startswith("admin_")]
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(
+            drive(virtual_users[0], admin_steps, [SCENARIO_WEIGHTS[step] for step in admin_steps], deadline),
+            *(drive(user, user_steps, [SCENARIO_WEIGHTS[step] for step in user_steps], deadline)
+              for user in virtual_users[1:]))
+        elapsed = time.perf_counter() - started
+
+    report = recorder.report(elapsed)
+    report["config"] = {"virtual_users": users,
+                        "seeded_users": seeded_users,
+                        "duration_seconds": duration,
+                        "target": base_url or "in-process",
+                        "rate_limits": None if base_url else rate_limits,
+                        "seed": random_seed,
+                        "commit": current_commit()}
+    return report
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a mixed workload and report per-endpoint latency percentiles")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users, one of them is the admin")
+    parser.add_argument("--seeded-users", type=int, default=100, help="--users value that was passed to loadtest.seed")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--base-url", help="Hit a running server instead of the in-process app; "
+                                             "start it with RATE_LIMIT_ENABLED=false")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="Keep the in-process app's rate limits on, although all virtual users share one address")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.users, args.seeded_users, args.duration, args.base_url, args.seed, args.rate_limits))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import random
+
+from datetime import date, timedelta
+
+from app.core.hashing import password_hasher
+from app.core.db_core import run_migrations
+
+from app.db.database import async_engine
+
+from app.models.card import Card_import_row, Payment_system
+from app.models.transaction import Payment
+from app.models.user import User_In_DB, user_operations
+
+from app.crud.card import Card_CRUD
+from app.crud.transaction import transaction_crud
+from app.crud.user import user_CRUD_operations
+
+
+PASSWORD = "Loadtest1!"
+
+
+def user_email(index: int) -> str:
+    return f"loadtest-user-{index}@example.com"
+
+
+def luhn_number(rng: random.Random) -> str:
+    digits = [rng.randint(0, 9) for _ in range(15)]
+    checksum = 0
+    for position, digit in enumerate(reversed(digits)):
+        if position % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        checksum += digit
+    return "".join(map(str, digits)) + str((10 - checksum % 10) % 10)
+
+
+async def seed(users: int, cards_per_user: int, transactions_per_card: int, random_seed: int):
+    rng = random.Random(random_seed)
+    await run_migrations()
+    # Every synthetic user shares one password so seeding pays for a single bcrypt hash
+    hashed_password = await password_hasher.hash(PASSWORD)
+
+    counts = {"users": 0, "cards": 0, "transactions": 0}
+    for index in range(users):
+        username = f"loadtest_{index}"
+        if not await user_operations.check_if_username_exists(username):
+            await user_CRUD_operations.add_new_user(User_In_DB(username=username,
+                                                               hashed_password=hashed_password,
+                                                               email=user_email(index),
+                                                               name="Load",
+                                                               surname=f"Test{index}",
+                                                               patronymic="",
+                                                               phone_number="+000000000000",
+                                                               address="",
+                                                               disabled=False))
+            counts["users"] += 1
+        user = await user_CRUD_operations.get_user_by_username(username)
+
+        cards = [Card_import_row(number=luhn_number(rng),
+                                 carrier_name=f"LOAD TEST {index}",
+                                 expires_date=date.today() + timedelta(days=rng.randint(90, 1500)),
+                                 payment_system=rng.choice(list(Payment_system)),
+                                 cvv=f"{rng.randint(0, 999):03d}")
+                 for _ in range(cards_per_user)]
+        _, card_ids = await Card_CRUD.add_cards_bulk(cards, user.id)
+        counts["cards"] += len(card_ids)
+
+        payments = [Payment(card_id=card_id,
+                            money_amount=round(rng.uniform(1, 500), 2),
+                            company_name=f"Merchant {rng.randint(1, 50)}")
+                    for card_id in card_ids.values()
+                    for _ in range(transactions_per_card)]
+        if payments:
+            results = await transaction_crud.add_payments_batch(payments, user.id)
+            counts["transactions"] += sum(result.accepted for result in results)
+
+    password_hasher.shutdown()
+    await async_engine.dispose()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a synthetic dataset for load testing")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--cards-per-user", type=int, default=3)
+    parser.add_argument("--transactions-per-card", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    counts = asyncio.run(seed(args.users, args.cards_per_user, args.transactions_per_card, args.seed))
+    print(counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,15 @@ from datetime import datetime
 from typing import Annotated
 
 from fastapi import FastAPI, Depends
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from app.core.scheduler import scheduler_manager
-from app.core.db_core import create_tables
+from app.core.hashing import password_hasher
+from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, metrics_registry
+from app.core.db_core import ensure_schema
+
+from app.db.database import async_engine, read_session_factory, warm_up_pool, check_database
 
 from app.api.endpoints import auth, cards, transactions, account, admin
 from app.api.dependencies import get_current_active_user
@@ -16,17 +22,33 @@ from app.models.user import User
 
 from app.api.permission import permission_operations
 
+from app.crud.transaction import transaction_buffer
+
+from app.services.export_service import export_service
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    await create_tables()
+    app.state.ready = False
+    await ensure_schema()
+    if settings.DB_POOL_WARMUP:
+        await warm_up_pool(async_engine, settings.DB_POOL_SIZE)
+    read_session_factory.start()
     await scheduler_manager.start_scheduler()
+    export_service.start()
     await permission_operations.create_first_admin()
+    app.state.ready = True
     yield
     # Shutdown
+    app.state.ready = False
     await scheduler_manager.shutdown_scheduler()
+    await export_service.shutdown()
+    await transaction_buffer.close()
+    await read_session_factory.stop()
+    password_hasher.shutdown()
 
 app = FastAPI(title="Virtual cards api", version="1.0.0", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 
 
@@ -46,6 +68,25 @@ async def root():
     }
 
 
+@app.get("/metrics", tags = ["Check"], response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/health/live", tags = ["Check"])
+async def liveness():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", tags = ["Check"])
+async def readiness():
+    if not getattr(app.state, "ready", False):
+        return JSONResponse({"status": "starting"}, status_code=503)
+    if not await check_database(async_engine, settings.HEALTH_CHECK_TIMEOUT_SECONDS):
+        return JSONResponse({"status": "database unavailable"}, status_code=503)
+    return {"status": "ready"}
+
+
 @app.get("/health", tags = ["Check"])
 async def health_check(current_user: Annotated[User, Depends(permission_operations.require_permission("check", "health_check"))]):
     return {